@@ -0,0 +1,262 @@
+"""
+Compiler benchmarks over synthetic programs.
+
+    python -m bench                 compare against bench/baselines.json
+    python -m bench --save          store the current timings as baseline
+    python -m bench -s depth -r 21  run one scenario with more repeats
+    python -m bench --memory        also report the memory held by the AST
+    python -m bench --lexers 4      lex a 4 MB program with both lexers
+
+Lexing, parsing (LALR and Pratt), populate_scope, lower, optimize and
+generate_c are timed separately. Timings are multiples of a fixed
+calibration workload run alternately with each stage, so baselines carry
+over between machines and survive changes in load; a stage's timing is
+the median over --repeat such pairs.
+
+Timings vary from run to run. With the default 11 repeats, the median of
+a stage moved by about 10% between runs on an idle machine, and by up to
+35% for the stages that take well under a millisecond. --save therefore
+measures --rounds full runs and stores, per stage, their median and a
+tolerance of twice the spread between them, at least --threshold. A
+stage fails the run when it is slower than its baseline by more than
+its tolerance. One failing run on a busy machine is noise; a real
+regression fails again with -s and more --repeat.
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from bench.generators import SCENARIOS, generate_program
+from src import log
+from src.pitchlexer import PitchLexer
+from src.pitchparser import PitchParser
+from src.prattparser import PrattParser
+from src.profiler import count_nodes
+from src.source import Source
+from src.tokenizer import tokenize
+import src.pitch_std as std
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+STAGES = ("lex", "parse", "parse_pratt", "populate_scope", "lower", "optimize", "generate_c")
+
+
+def best_of(repeat: int, setup, run) -> float:
+    best = None
+    for _ in range(repeat):
+        state = setup()
+        # As in timeit, no collection of earlier garbage lands in the run
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(state)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibration(_):
+    # A fixed workload of the kind the compiler does (string building,
+    # dict and list churn), the unit stage timings are given in
+    table = {}
+    for i in range(20_000):
+        key = f"name{i % 997}"
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = []
+        entry.append((i, key))
+
+
+def relative(repeat: int, setup, run) -> float:
+    # Median over runs of a stage's time in units of a calibration run
+    # right before it, so that both of a pair see the same load on the
+    # machine. A first, untimed run fills the caches.
+    calibration(None)
+    run(setup())
+    ratios = []
+    for _ in range(repeat):
+        unit = best_of(1, lambda: None, calibration)
+        ratios.append(best_of(1, setup, run) / unit)
+    return statistics.median(ratios)
+
+
+def lex_all(lexer: PitchLexer, source: str):
+    lexer.lexer.input(source)
+    while lexer.lexer.token():
+        pass
+
+
+def compare_lexers(megabytes: float, repeat: int):
+    # src.tokenizer against PLY's lexer on one large program
+    functions = max(1, int(megabytes * 1024 * 1024 / len(generate_program(functions=1))))
+    source = generate_program(functions=functions)
+    size = len(source) / (1024 * 1024)
+    lexer = PitchLexer()
+    print(f"lexing {size:.1f} MB, {len(tokenize(source))} tokens")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "large.pitch")
+        with open(path, "w") as f:
+            f.write(source)
+
+        def mapped(_):
+            with Source(path) as mapping:
+                tokenize(mapping.buffer)
+
+        for name, run in (("tokenizer", lambda _: tokenize(source)),
+                          ("tokenizer mmap", mapped),
+                          ("ply", lambda _: lex_all(lexer, source))):
+            seconds = best_of(repeat, lambda: None, run)
+            print(f"{name:>16}: {seconds * 1000:8.2f} ms, {size / seconds:6.2f} MB/s")
+
+
+def populated(parser: PitchParser | PrattParser, source: str):
+    program = parser.parse(source)
+    program.preprocess({})
+    program.populate_scope([std.Alloc()])
+    return program
+
+
+def lowered(parser: PitchParser | PrattParser, source: str):
+    program = populated(parser, source)
+    program.inline()
+    program.lower()
+    return program
+
+
+def ast_memory(name: str) -> tuple[int, int]:
+    # Bytes still allocated once a parsed and scoped program is built
+    # (the program and what it references), and its node count
+    source = generate_program(**SCENARIOS[name])
+    parser = PitchParser()
+    gc.collect()
+    tracemalloc.start()
+    program = populated(parser, source)
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, count_nodes(program)
+
+
+def run_scenario(name: str, repeat: int) -> dict[str, float]:
+    source = generate_program(**SCENARIOS[name])
+    parser = PitchParser()
+    pratt = PrattParser()
+
+    # Setups parse with the Pratt parser, it builds the same tree faster
+    def parsed():
+        program = pratt.parse(source)
+        program.preprocess({})
+        return program
+
+    return {
+        "lex": relative(repeat, lambda: None, lambda _: tokenize(source)),
+        "parse": relative(repeat, lambda: None, lambda _: parser.parse(source)),
+        "parse_pratt": relative(repeat, lambda: None, lambda _: pratt.parse(source)),
+        "populate_scope": relative(repeat, parsed,
+                                   lambda program: program.populate_scope([std.Alloc()])),
+        "lower": relative(repeat, lambda: populated(pratt, source),
+                          lambda program: program.lower()),
+        "optimize": relative(repeat, lambda: lowered(pratt, source),
+                             lambda program: program.optimize()),
+        "generate_c": relative(repeat, lambda: lowered(pratt, source),
+                               lambda program: program.generate_c(io.StringIO())),
+    }
+
+
+def baseline(rounds: list[float], threshold: float) -> dict[str, float]:
+    # What --save stores for one stage, from its timing in each round
+    units = statistics.median(rounds)
+    spread = (max(rounds) - min(rounds)) / units
+    return {"units": units, "tolerance": max(threshold, 2 * spread)}
+
+
+def compare(results, baselines, threshold) -> list[str]:
+    regressions = []
+    for scenario, stages in results.items():
+        for stage, units in stages.items():
+            expected = baselines.get(scenario, {}).get(stage)
+            if expected is None:
+                regressions.append(f"{scenario}/{stage}: no baseline, run with --save")
+                continue
+            tolerance = max(threshold, expected["tolerance"])
+            if units > expected["units"] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario}/{stage}: {units:.2f} units vs baseline {expected['units']:.2f}"
+                    f" (+{units / expected['units'] - 1:.0%}, tolerance {tolerance:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pitch compiler benchmarks")
+    parser.add_argument("-s", "--scenario", action="append", choices=list(SCENARIOS),
+                        help="Scenario to run (repeatable, default all)")
+    parser.add_argument("-r", "--repeat", type=int, default=11,
+                        help="Runs per stage, the median counts")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Smallest allowed slowdown against a baseline (0.25 = 25%%)")
+    parser.add_argument("--save", action="store_true",
+                        help="Store the results as the new baseline")
+    parser.add_argument("--rounds", type=int, default=3,
+                        help="Full runs measured for --save, their spread sets the tolerance")
+    parser.add_argument("--memory", action="store_true",
+                        help="Report the memory held by each scenario's AST")
+    parser.add_argument("--lexers", type=float, metavar="MB",
+                        help="Only compare the lexers on a program of about MB megabytes")
+    args = parser.parse_args()
+
+    log.configure(False)
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+
+    if args.lexers:
+        compare_lexers(args.lexers, args.repeat)
+        return
+
+    # Timings of each stage per round
+    rounds = {}
+    for _ in range(args.rounds if args.save else 1):
+        for name in args.scenario or SCENARIOS:
+            results = run_scenario(name, args.repeat)
+            print(f"{name:<12}" + "".join(
+                [f"{stage:>16}: {results[stage]:8.2f}" for stage in STAGES]))
+            for stage, units in results.items():
+                rounds.setdefault(name, {}).setdefault(stage, []).append(units)
+    if args.memory:
+        for name in args.scenario or SCENARIOS:
+            size, nodes = ast_memory(name)
+            print(f"{name:<12}{'ast':>16}: {size / 1024:8.0f} KiB for {nodes} nodes, "
+                  f"{size / nodes:.0f} bytes per node")
+
+    baselines = {}
+    if os.path.isfile(BASELINES):
+        with open(BASELINES) as f:
+            baselines = json.load(f)
+
+    if args.save:
+        baselines.update({name: {stage: baseline(units, args.threshold) for stage, units in stages.items()}
+                          for name, stages in rounds.items()})
+        with open(BASELINES, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Saved baseline to {BASELINES}")
+        return
+
+    results = {name: {stage: units[0] for stage, units in stages.items()}
+               for name, stages in rounds.items()}
+    regressions = compare(results, baselines, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Synthetic Pitch programs for the compiler benchmarks. Every axis scales
+# independently, the rest of the program stays the same.
+
+
+def expression(depth: int, operands: list[str]) -> str:
+    # Sum over the operands, nested `depth` groups deep
+    expr = operands[0]
+    for index in range(depth):
+        expr = f"({expr} + {operands[(index + 1) % len(operands)]})"
+    return expr
+
+
+def struct(index: int, members: int) -> str:
+    member_list = "\n".join([f"    m{i}: i32;" for i in range(members)])
+    return f"struct S{index} {{\n{member_list}\n}}\n"
+
+
+def function(index: int, statements: int, members: int, depth: int, strings: int, identifiers: int,
+             nesting: int) -> str:
+    body = []
+    if members:
+        fields = ", ".join([f"m{i}: {i}" for i in range(members)])
+        body.append(f"    let s = S{index} {{{fields}}};")
+
+    # The lets are spread over `nesting` nested blocks; only those of the
+    # outermost one are still in scope at the return
+    locals = ["a"]
+    result = "a"
+    level = 0
+    for i in range(statements):
+        while level < i * (nesting + 1) // statements:
+            body.append(f"{'    ' * (level + 1)}if (a) {{")
+            level += 1
+        operands = locals[-identifiers:] if identifiers else [str(i + 1)]
+        body.append(f"{'    ' * (level + 1)}let v{i} = {expression(depth, operands + [str(i + 1)])};")
+        locals.append(f"v{i}")
+        if not level:
+            result = f"v{i}"
+    while level:
+        body.append(f"{'    ' * level}}}")
+        level -= 1
+
+    for i in range(strings):
+        body.append(f'    let t{i} = "string literal {index} {i}";')
+
+    body.append(f"    return {result};")
+    return f"fn f{index}(a: i32) i32 {{\n" + "\n".join(body) + "\n}\n"
+
+
+def generate_program(functions=10, statements=10, members=4, depth=2, strings=2, identifiers=2,
+                     nesting=0) -> str:
+    parts = []
+    for index in range(functions):
+        if members:
+            parts.append(struct(index, members))
+        parts.append(function(index, statements, members,
+                     depth, strings, identifiers, nesting))
+
+    calls = " + ".join([f"f{index}({index})" for index in range(functions)])
+    parts.append(f"fn main() i32 {{\n    return {calls or 0};\n}}\n")
+    return "\n".join(parts)
+
+
+# Each scenario pushes one axis, everything else stays at its default.
+SCENARIOS = {
+    "baseline": {},
+    "functions": {"functions": 400},
+    "statements": {"functions": 4, "statements": 1000},
+    "members": {"functions": 20, "members": 400},
+    "depth": {"functions": 20, "depth": 200},
+    "strings": {"functions": 20, "strings": 400},
+    "identifiers": {"functions": 20, "statements": 100, "identifiers": 50},
+    "nesting": {"functions": 20, "statements": 400, "nesting": 200},
+}
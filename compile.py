@@ -1,25 +1,63 @@
 #!/usr/bin/python3.12
 import argparse
 import os
+import sys
 
+from src import log
+from src.error import CompileError, report
 from src.main import PitchCompiler
+from src.profiler import PhaseProfiler
+from src.project import ProjectCompiler
 from src.nodes.utils import printlog
 
 parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('source', metavar='source', type=str, help='Input file')
+parser.add_argument('source', metavar='source', type=str, nargs='+',
+                    help='Input file, or several files / directories to build as a project')
 parser.add_argument('-d', dest='debug', action='store_true',
                     help='Debug enabled')
+parser.add_argument('--log', dest='log_phases', action='append',
+                    choices=log.PHASES, default=None,
+                    help='Restrict debug output to a compiler phase (repeatable)')
+parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                    help='Worker processes for project builds')
+parser.add_argument('--no-cache', dest='cache', action='store_false',
+                    help='Rebuild every module of a project build')
+parser.add_argument('--parser', dest='parser', choices=('lalr', 'pratt'), default='lalr',
+                    help='Parser to build the syntax tree with')
+parser.add_argument('--profile', dest='profile', action='store_true',
+                    help='Report time, memory and node counts per compiler phase')
+parser.add_argument('--profile-cprofile', dest='cprofile_path', metavar='FILE',
+                    help='Write a cProfile dump of the compile to FILE')
+parser.add_argument('--profile-trace', dest='trace_path', metavar='FILE',
+                    help='Write per-phase timings as a Chrome trace JSON to FILE')
 
 args = parser.parse_args()
+log.configure(args.debug, args.log_phases)
 printlog(args.debug)
 
 # get filepath from call
 current_directory = os.getcwd()
-source_path = os.path.join(current_directory, args.source)
-printlog(source_path)
+source_paths = [os.path.join(current_directory, source)
+                for source in args.source]
+printlog(source_paths)
 output_path = os.path.join(current_directory, "out")
+profiler = PhaseProfiler(enabled=args.profile, cprofile_path=args.cprofile_path,
+                         trace_path=args.trace_path)
 
-# source_path, debug=args.debug
-compiler = PitchCompiler(source_file=source_path,
-                         out_path=output_path, debug=args.debug)
-compiler.compile()
+if len(source_paths) == 1 and not os.path.isdir(source_paths[0]):
+    # source_path, debug=args.debug
+    compiler = PitchCompiler(source_file=source_paths[0],
+                             out_path=output_path, debug=args.debug,
+                             log_phases=args.log_phases, profiler=profiler,
+                             parser=args.parser)
+else:
+    compiler = ProjectCompiler(sources=source_paths,
+                               out_path=output_path, debug=args.debug,
+                               log_phases=args.log_phases, jobs=args.jobs,
+                               cache=args.cache, profiler=profiler,
+                               parser=args.parser)
+try:
+    compiler.compile()
+except CompileError as error:
+    report(error)
+    sys.exit(1)
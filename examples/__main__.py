@@ -0,0 +1,80 @@
+"""
+Compiles, builds and runs the example programs.
+
+    python -m examples                  every example, with both parsers
+    python -m examples fold             only examples/fold.pitch
+    python -m examples --parser pratt   only one parser
+
+Each example goes through compile.py into a temporary directory, the C
+it generates is built with $CC (default gcc), warnings as errors, and
+run. The exit status of the program must be the one in EXPECTED. A
+directory is built as one project, all its modules linked into one
+program.
+"""
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+
+EXAMPLES = os.path.dirname(os.path.abspath(__file__))
+COMPILER = os.path.join(os.path.dirname(EXAMPLES), "compile.py")
+
+# Exit status of each example program
+EXPECTED = {
+    "alloc": 16,
+    "arena_copy": 1,
+    "arena_param": 3,
+    "fold": 6,
+    "inline_precedence": 18,
+    "strings": 7,
+    "unicode": 5,
+}
+
+
+def run(name: str, parser: str) -> str | None:
+    # Returns what went wrong, None if the example exits as expected
+    source = os.path.join(EXAMPLES, name)
+    if not os.path.isdir(source):
+        source += ".pitch"
+    with tempfile.TemporaryDirectory() as directory:
+        compiled = subprocess.run([sys.executable, COMPILER, "--parser", parser, source],
+                                  cwd=directory, capture_output=True, text=True)
+        if compiled.returncode:
+            return f"compile failed\n{compiled.stdout}{compiled.stderr}"
+        binary = os.path.join(directory, "program")
+        built = subprocess.run([os.environ.get("CC", "gcc"), "-Werror", "-o", binary,
+                                *glob.glob(os.path.join(directory, "out", "*.c"))],
+                               capture_output=True, text=True)
+        if built.returncode:
+            return f"C build failed\n{built.stderr}"
+        status = subprocess.run([binary]).returncode
+        if status != EXPECTED[name]:
+            return f"exited {status}, expected {EXPECTED[name]}"
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pitch example programs")
+    parser.add_argument("example", nargs="*",
+                        help="Example to run (default all)")
+    parser.add_argument("--parser", action="append", choices=("lalr", "pratt"),
+                        help="Parser to compile with (repeatable, default both)")
+    args = parser.parse_args()
+    unknown = [name for name in args.example if name not in EXPECTED]
+    if unknown:
+        parser.error(f"unknown example {', '.join(unknown)}, choose from {', '.join(EXPECTED)}")
+
+    failures = 0
+    for name in args.example or EXPECTED:
+        for parser_name in args.parser or ("lalr", "pratt"):
+            problem = run(name, parser_name)
+            print(f"{name:<20}{parser_name:<8}{problem or 'ok'}")
+            failures += problem is not None
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
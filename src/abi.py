@@ -0,0 +1,54 @@
+from src.pitchtypes import IntType, LocalStringType, StructType
+
+# Calling convention of generated functions. Structs up to two machine
+# words travel by value (in registers on the common 64 bit ABIs); larger
+# ones are passed as `const struct X*` and returned through an out pointer
+# supplied by the caller, so records are never copied across calls.
+
+POINTER_SIZE = 8
+BY_REFERENCE_SIZE = 2 * POINTER_SIZE
+
+# Name of the out pointer parameter of functions returning large structs
+OUT = "_pt_out"
+
+
+def layout(t) -> tuple[int, int]:
+    # (size, alignment) of t in bytes, laid out like the C compiler does
+    if isinstance(t, IntType):
+        return t.size // 8, t.size // 8
+    if isinstance(t, LocalStringType):
+        # _pt_str is a pointer and an int
+        return 2 * POINTER_SIZE, POINTER_SIZE
+    if isinstance(t, StructType):
+        size, align = 0, 1
+        for field in t.fields.values():
+            field_size, field_align = layout(field)
+            size = -(-size // field_align) * field_align + field_size
+            align = max(align, field_align)
+        return -(-size // align) * align, align
+    # References, arenas
+    return POINTER_SIZE, POINTER_SIZE
+
+
+def by_reference(t) -> bool:
+    return isinstance(t, StructType) and layout(t)[0] > BY_REFERENCE_SIZE
+
+
+def c_param(t, name: str = "") -> str:
+    c = f"const {t.to_c()}*" if by_reference(t) else t.to_c()
+    return f"{c} {name}" if name else c
+
+
+def c_return(t) -> str:
+    return "void" if by_reference(t) else t.to_c()
+
+
+def c_out(t, name: str = OUT) -> str:
+    return f"{t.to_c()}* {name}" if name else f"{t.to_c()}*"
+
+
+def prototype(name: str, function_type) -> str:
+    params = [c_param(param) for param in function_type.params]
+    if by_reference(function_type.return_type):
+        params.append(c_out(function_type.return_type, ""))
+    return f'{c_return(function_type.return_type)} {name}({", ".join(params) or "void"});'
@@ -0,0 +1,237 @@
+from src import abi, cgen, ir
+from src.context import Context
+from src.log import CGEN, printlog
+from src.pitchtypes import ArenaType
+
+# Values naming storage, their address can be passed on directly
+ADDRESSABLE = frozenset((ir.LOAD, ir.DEREF, ir.FIELD, ir.STRUCT, ir.ARENA_STRUCT))
+
+# How tightly C binds each operator, higher binds tighter
+BINARY_PRECEDENCE = {"==": 1, "+": 2, "-": 2, "*": 3, "/": 3}
+UNARY_PRECEDENCE = 4
+POSTFIX_PRECEDENCE = 5
+
+
+class CBackend():
+    # Emits the C of one instruction list. A value is rendered where its
+    # statement uses it, so expressions come out nested as in the source
+    # and values no statement uses are never emitted.
+    def __init__(self, code: list[ir.Instr], writer: cgen.CWriter, context: Context):
+        self.code = code
+        self.writer = writer
+        self.context = context
+        # (header, writer outside) of each open if, innermost last
+        self.open: list[tuple[str, cgen.CWriter]] = []
+
+    def emit(self):
+        for instr in self.code:
+            if instr.op in ir.STATEMENTS:
+                self.statement(instr)
+
+    def by_reference(self, instr: ir.Instr) -> bool:
+        # Calls whose result comes back through an out pointer
+        return instr.op == ir.CALL and abi.by_reference(instr.t)
+
+    def addressable(self, index: int) -> bool:
+        instr = self.code[index]
+        while instr.op == ir.GROUP:
+            instr = self.code[instr.args[0]]
+        return instr.op in ADDRESSABLE or self.by_reference(instr)
+
+    def precedence(self, instr: ir.Instr) -> int:
+        if instr.op == ir.BINARY:
+            return BINARY_PRECEDENCE[instr.a]
+        if instr.op == ir.ADDRESS or instr.op == ir.DEREF:
+            return UNARY_PRECEDENCE
+        return POSTFIX_PRECEDENCE
+
+    def operand(self, index: int, precedence: int) -> str:
+        # Parenthesised where it binds looser than its operator needs.
+        # Trees of the source already nest like C, inlined bodies need not.
+        value = self.value(index)
+        if self.precedence(self.code[index]) < precedence:
+            return f'({value})'
+        return value
+
+    def value(self, index: int) -> str:
+        instr = self.code[index]
+        op = instr.op
+        if op == ir.CONST:
+            return str(instr.a)
+        if op == ir.STRING:
+            # The length in bytes, as stored
+            return cgen.PitchString(instr.a, len(instr.a.encode())).to_const(self.writer, self.context)
+        if op == ir.LOAD:
+            if instr.a in self.context.borrowed:
+                return f'(*{instr.a})'
+            return instr.a
+        if op == ir.BINARY:
+            # All left associative, a right operand of the same precedence
+            # needs parentheses
+            precedence = BINARY_PRECEDENCE[instr.a]
+            return f'{self.operand(instr.args[0], precedence)} {instr.a} ' \
+                f'{self.operand(instr.args[1], precedence + 1)}'
+        if op == ir.GROUP:
+            return f'({self.value(instr.args[0])})'
+        if op == ir.ADDRESS:
+            return f'&{self.operand(instr.args[0], UNARY_PRECEDENCE)}'
+        if op == ir.DEREF:
+            return f'*{self.operand(instr.args[0], UNARY_PRECEDENCE)}'
+        if op == ir.FIELD:
+            return f'{self.operand(instr.args[0], POSTFIX_PRECEDENCE)}->{instr.a}'
+        if op == ir.STRUCT:
+            return f'(struct {instr.a}){{ {self.members(instr.b, instr.args)} }}'
+        if op == ir.ARENA_STRUCT:
+            names, arena, _ = instr.b
+            members = self.members(names, instr.args)
+            self.writer.append_tls(cgen.CStatement(cgen.runtime("arena")))
+            struct_c = instr.t.to.to_c()
+            tmp = self.context.register_symbol("tmp")
+            self.writer.append_statement(
+                f'{struct_c} *{tmp} = _pt_arena_alloc({arena}, sizeof({struct_c}));')
+            self.writer.append_statement(f'*{tmp} = ({struct_c}){{ {members} }};')
+            return tmp
+        if op == ir.LIB:
+            return instr.a.generate_c([self.value(arg) for arg in instr.args],
+                                      instr.b, self.writer, self.context)
+        if op == ir.CALL:
+            return self.call(instr)
+        raise ValueError(f'{op} is not a value')
+
+    def members(self, names, args) -> str:
+        return ", ".join([f'.{name}={self.value(arg)}' for name, arg in zip(names, args)])
+
+    def argument(self, index: int, param) -> str:
+        if not abi.by_reference(param):
+            return self.value(index)
+        instr = self.code[index]
+        if instr.op == ir.LOAD and instr.a in self.context.borrowed:
+            return instr.a
+        value = self.value(index)
+        if self.addressable(index):
+            return f'&{value}'
+        # Rvalues need storage to point to
+        tmp = self.context.register_symbol("arg")
+        self.writer.append_statement(f'{param.to_c()} {tmp} = {value};')
+        return f'&{tmp}'
+
+    def call(self, instr: ir.Instr, out: str = None) -> str | None:
+        name, t = instr.a, instr.b
+        printlog("Generating call", name, "with", len(instr.args), "args", phase=CGEN)
+        if name in self.context.storage and name not in self.context.defined:
+            # Defined further down
+            self.writer.append_tls(cgen.CStatement(
+                self.context.storage[name] + abi.prototype(name, t)))
+        params = t.params
+        args = [self.argument(arg, params[i] if i < len(params) else None)
+                for i, arg in enumerate(instr.args)]
+        if not self.by_reference(instr):
+            return f'{name}({", ".join(args)})'
+
+        # The result is written through an out pointer: the caller's if
+        # given, else a temporary which becomes the call's value.
+        result = None
+        if out is None:
+            result = self.context.register_symbol("tmp")
+            self.writer.append_statement(f'{instr.t.to_c()} {result};')
+            out = f'&{result}'
+        self.writer.append_statement(f'{name}({", ".join(args + [out])});')
+        return result
+
+    def statement(self, instr: ir.Instr):
+        op = instr.op
+        writer = self.writer
+        if op == ir.LET:
+            value = self.code[instr.args[0]]
+            if self.by_reference(value):
+                # Let the callee construct the struct in place
+                writer.append_statement(f'{instr.t.to_c()} {instr.a};')
+                self.call(value, out=f'&{instr.a}')
+            else:
+                writer.append_statement(
+                    f'{instr.t.to_c()} {instr.a} = {self.value(instr.args[0])};')
+        elif op == ir.STORE:
+            target = self.value(instr.args[0])
+            writer.append_statement(f'{target} = {self.value(instr.args[1])};')
+        elif op == ir.EVAL:
+            value = self.code[instr.args[0]]
+            if self.by_reference(value):
+                # Emitted into a temporary already
+                self.call(value)
+            else:
+                writer.append_statement(f'{self.value(instr.args[0])};')
+        elif op == ir.RETURN:
+            self.return_(instr)
+        elif op == ir.IF:
+            self.open.append((f'if ({self.value(instr.args[0])})', writer))
+            self.writer = cgen.CWriter(writer.top_level_writer)
+        elif op == ir.END:
+            header, outer = self.open.pop()
+            outer.append(cgen.CCompound(header, writer.export()))
+            self.writer = outer
+        elif op == ir.FREE:
+            writer.append_statement(f'_pt_arena_free({instr.a});')
+
+    def return_(self, instr: ir.Instr):
+        arenas = instr.b
+        value = self.code[instr.args[0]]
+        out = self.context.out
+        if out:
+            # Large structs are written straight to the caller's storage
+            if self.by_reference(value):
+                self.call(value, out=out)
+            else:
+                self.writer.append_statement(f'*{out} = {self.value(instr.args[0])};')
+            for arena in reversed(arenas):
+                self.writer.append_statement(f'_pt_arena_free({arena});')
+            self.writer.append_statement('return;')
+            return
+
+        if not arenas:
+            self.writer.append_statement(f'return {self.value(instr.args[0])};')
+            return
+
+        # Evaluate before the function's arenas are released
+        result = self.context.register_symbol("ret")
+        self.writer.append_statement(
+            f'{instr.t.to_c()} {result} = {self.value(instr.args[0])};')
+        for arena in reversed(arenas):
+            self.writer.append_statement(f'_pt_arena_free({arena});')
+        self.writer.append_statement(f'return {result};')
+
+
+def generate_function(function: ir.FunctionIR, top_level_writer: cgen.CWriter, context: Context):
+    printlog("C ing function", function.name, phase=CGEN)
+    writer = cgen.CWriter(top_level_writer)
+
+    # Large structs arrive as const pointers and are read in place,
+    # unless the body writes to them; those get one local copy.
+    large = [name for name, t in function.params if abi.by_reference(t)]
+    stored = {entry.name for entry in ir.written(function.code)}
+    borrowed = [name for name in large if name not in stored]
+    out = abi.OUT if abi.by_reference(function.return_type) else None
+
+    reserved = [name for name, _ in function.params] + \
+        [instr.a for instr in function.code if instr.op == ir.LET]
+    with context.function_scope(reserved, out=out, borrowed=borrowed):
+        args = []
+        for name, t in function.params:
+            if name in large and name in stored:
+                copy = context.register_symbol(f"{name}_in")
+                writer.append_statement(f'{t.to_c()} {name} = *{copy};')
+                args.append(abi.c_param(t, copy))
+            else:
+                args.append(abi.c_param(t, name))
+            if isinstance(t, ArenaType):
+                writer.append_tls(cgen.CStatement(cgen.runtime("arena")))
+        if out:
+            args.append(abi.c_out(function.return_type))
+        CBackend(function.code, writer, context).emit()
+
+    c_function = cgen.CFunction(
+        name=function.name, return_type=abi.c_return(function.return_type), args=", ".join(args),
+        root=None, parent=None, storage=context.storage.get(function.name, "")
+    )
+    context.defined.add(function.name)
+    c_function.body.statements = writer.export()
+    top_level_writer.append(c_function)
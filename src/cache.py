@@ -0,0 +1,101 @@
+import hashlib
+import importlib.util
+import os
+import pickle
+
+
+def cache_dir(*parts: str) -> str | None:
+    root = os.environ.get("PITCH_CACHE_DIR")
+    if not root:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+            os.path.expanduser("~"), ".cache")
+        root = os.path.join(base, "pitch")
+
+    path = os.path.join(root, *parts)
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError:
+        return None
+    return path
+
+
+def fingerprint(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def load_table(directory: str | None, name: str):
+    if directory is None:
+        return None
+
+    path = os.path.join(directory, name + ".py")
+    if not os.path.isfile(path):
+        return None
+
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        # Half written or stale table, let PLY regenerate it
+        return None
+    return module
+
+
+_compiler_fingerprint = None
+
+
+def compiler_fingerprint() -> str:
+    # Hash of the compiler's own sources, so build cache entries written by
+    # a different compiler version are never reused.
+    global _compiler_fingerprint
+    if _compiler_fingerprint is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for directory, _, files in sorted(os.walk(root)):
+            for file in sorted(files):
+                if not file.endswith((".py", ".h")):
+                    continue
+                path = os.path.join(directory, file)
+                digest.update(os.path.relpath(path, root).encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+        _compiler_fingerprint = digest.hexdigest()[:16]
+    return _compiler_fingerprint
+
+
+class BuildCache():
+    # Content addressed store for build artifacts, one pickle per key.
+    def __init__(self, directory: str | None):
+        self.directory = directory
+
+    def key(self, *parts) -> str:
+        return fingerprint(compiler_fingerprint(), *parts)
+
+    def path(self, kind: str, key: str) -> str:
+        return os.path.join(self.directory, f"{kind}-{key}.pickle")
+
+    def load(self, kind: str, key: str):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(kind, key), "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+    def store(self, kind: str, key: str, value):
+        if self.directory is None:
+            return
+        path = self.path(kind, key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PicklingError, RecursionError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
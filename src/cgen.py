@@ -1,5 +1,54 @@
+import functools
+import io
+import os
+from contextlib import contextmanager
+
 from src.context import Context
 
+RUNTIME_DIR = os.path.join(os.path.dirname(__file__), "runtime")
+
+
+@functools.cache
+def runtime(name: str) -> str:
+    # C runtime support code, emitted once per translation unit
+    with open(os.path.join(RUNTIME_DIR, f"{name}.h"), "r") as f:
+        return f.read().rstrip("\n")
+
+
+class CEmitter():
+    # Writes C straight into a text stream, tracking indentation and the
+    # blank line between top level items.
+    def __init__(self, stream: io.TextIOBase, level=0, indent="    "):
+        self.stream = stream
+        self.level = level
+        self.indent = indent
+        self._items = 0
+
+    def line(self, text: str):
+        self.stream.write(self.indent * self.level)
+        self.stream.write(text)
+        self.stream.write("\n")
+
+    @contextmanager
+    def indented(self):
+        self.level += 1
+        try:
+            yield self
+        finally:
+            self.level -= 1
+
+    def item(self, node):
+        if self._items:
+            self.stream.write("\n")
+        self._items += 1
+        node.write(self)
+
+
+def to_string(node, level=0) -> str:
+    buffer = io.StringIO()
+    node.write(CEmitter(buffer, level))
+    return buffer.getvalue().rstrip("\n")
+
 
 class CProgram():
     def __init__(self):
@@ -13,15 +62,21 @@ class CProgram():
         self._children = statements
         return self
 
+    def write(self, emitter: CEmitter):
+        for child in self._children:
+            emitter.item(child)
+
     def to_string(self, level=0):
-        # printlog("program to string called", self._children)
-        return '\n\n'.join([child.to_string() for child in self._children])
+        return to_string(self, level)
 
 
 class CStatement():
     def __init__(self, data):
         self.data = data
 
+    def write(self, emitter: CEmitter):
+        emitter.line(self.data)
+
     def to_string(self, level=0):
         return self.data
 
@@ -34,16 +89,37 @@ class CBlock():
         self.statements.append(statement)
         return self
 
+    def write(self, emitter: CEmitter):
+        for statement in self.statements:
+            statement.write(emitter)
+
+    def to_string(self, level=0):
+        return to_string(self, level)
+
+
+class CCompound():
+    # header { statements }, e.g. an if
+    def __init__(self, header, statements):
+        self.header = header
+        self.statements = statements
+
+    def write(self, emitter: CEmitter):
+        emitter.line(f'{self.header} {{')
+        with emitter.indented():
+            for statement in self.statements:
+                statement.write(emitter)
+        emitter.line('}')
+
     def to_string(self, level=0):
-        join_char = "\n" + ("    "*level)
-        return ("    "*level) + join_char.join([statement.to_string(level=level+1) for statement in self.statements])
+        return to_string(self, level)
 
 
 class CFunction():
-    def __init__(self, return_type, name, args, root, parent):
+    def __init__(self, return_type, name, args, root, parent, storage=""):
         self.return_type = return_type
         self.name = name
         self.args = args
+        self.storage = storage
         self.body = CBlock()
         self.root = root
         self.parent = parent
@@ -52,16 +128,28 @@ class CFunction():
         self.body.append(statement)
         return self
 
+    def write(self, emitter: CEmitter):
+        emitter.line(f'{self.storage}{self.return_type} {self.name}({self.args}) {{')
+        with emitter.indented():
+            self.body.write(emitter)
+        emitter.line('}')
+
     def to_string(self, level=0) -> str:
-        # printlog("c func to string called", self.body, self.body._statements)
-        return f'{self.return_type} {self.name}({self.args}) {{\n{self.body.to_string(level=level+1)}\n}}'
+        return to_string(self, level)
 
 
 class CWriter():
-    def __init__(self, top_level_writer=None):
+    def __init__(self, top_level_writer=None, emitter: CEmitter = None):
         self.statements = []
         self.top_level_writer = top_level_writer
         self.imports = []
+        self.emitter = emitter
+        # Keys of unique top level data (includes, typedefs, prototypes).
+        # Kept across flushes so each fragment is emitted once, in the
+        # order it was first appended.
+        self.unique: set[tuple[type, str]] = set()
+        # String literal -> symbol of its pooled constant
+        self.strings: dict[str, str] = {}
 
     def append_tls(self, data):
         self.top_level_writer.append_unique(data)
@@ -80,11 +168,28 @@ class CWriter():
         return self
 
     def append_unique(self, data):
-        for statement in self.statements:
-            if type(statement) == type(data) and statement.data == data.data:
-                return
+        key = (type(data), data.data)
+        if key in self.unique:
+            return
+        self.unique.add(key)
         self.statements.append(data)
 
+    def intern_string(self, value: str, context: Context) -> str:
+        # Every distinct literal becomes one read-only array at file scope,
+        # holding its UTF-8 bytes
+        if self.top_level_writer:
+            return self.top_level_writer.intern_string(value, context)
+
+        symbol = self.strings.get(value)
+        if symbol is None:
+            symbol = context.register_symbol("cconst", glob=True)
+            self.strings[value] = symbol
+            data = value.encode()
+            char_array = ",".join([c_char(byte) for byte in data]) or "0"
+            self.append(CStatement(
+                f"static const char {symbol}[{max(len(data), 1)}] = {{{char_array}}};"))
+        return symbol
+
     def export(self):
         statements = []
         if not self.top_level_writer:
@@ -93,12 +198,35 @@ class CWriter():
                     statements.append(CStatement(f'#include "{lib}"'))
                 else:
                     statements.append(CStatement(f'#include <{lib}>'))
+            self.imports = []
         statements.extend(self.statements)
 
         return statements
 
-    def to_string(self):
-        return self.program.to_string()
+    def flush(self):
+        # Stream everything written so far and let go of it
+        for statement in self.export():
+            self.emitter.item(statement)
+        self.statements = []
+
+
+# Module headers and the C of every program using strings may all define
+# it, one translation unit sees the first only
+STRING_TYPEDEF = "#ifndef PT_STR_DEFINED\n#define PT_STR_DEFINED\n" \
+    "typedef struct { const char*ptr; int len;} _pt_str;\n#endif"
+
+C_CHAR_ESCAPES = {"'": "\\'", "\\": "\\\\", "\n": "\\n", "\t": "\\t"}
+
+
+def c_char(byte: int) -> str:
+    # One byte of a UTF-8 string as a char constant; bytes outside of
+    # printable ASCII are hex escapes, which fit a char signed or not
+    char = chr(byte)
+    if char in C_CHAR_ESCAPES:
+        return f"'{C_CHAR_ESCAPES[char]}'"
+    if not char.isprintable() or not char.isascii():
+        return f"'\\x{byte:02x}'"
+    return f"'{char}'"
 
 
 class PitchString():
@@ -108,22 +236,11 @@ class PitchString():
         self.size = size
 
     def to_const(self, writer: CWriter, context: Context):
-        char_array = "{"+",".join([f"'{char}'" for char in self.value])+"}"
-
         writer.append_tls(CStatement(
             "#include <stdio.h> \n#include <string.h>"))
 
-        writer.append_tls(CStatement(
-            "typedef struct { char*ptr; int len;} _pt_str;"))
-
-        char_const_var = context.register_symbol("cconst")
-
-        writer.append(CStatement(
-            f"char {char_const_var}[{self.size}] = {char_array};"))
-
-        # str_struct = context.register_symbol("str")
+        writer.append_tls(CStatement(STRING_TYPEDEF))
 
-        # writer.append(cgen.CStatement(
-        #     f'_pt_str {str_struct} = {{ {char_const_var}, {self.t.size} }};'))
+        char_const_var = writer.intern_string(self.value, context)
 
         return f'(_pt_str){{ {char_const_var}, {self.size} }}'
@@ -1,7 +1,6 @@
 from abc import ABC
+from contextlib import contextmanager
 from dataclasses import dataclass
-import random
-import string
 
 
 class Context(object):
@@ -9,6 +8,18 @@ class Context(object):
         self.definitions = {}
         self.types = {}
         self.symbols = {}
+        # Next suffix per symbol prefix, so allocation never rescans
+        self.counters = {}
+        # (symbols, counters) of the function being generated
+        self.local = None
+        # Out pointer of the current function if it returns a large struct,
+        # and the struct parameters it received as pointers
+        self.out = None
+        self.borrowed = frozenset()
+        # Storage class prefix of each function of the program, and the
+        # ones already defined (later ones need a prototype when called)
+        self.storage: dict[str, str] = {}
+        self.defined: set[str] = set()
 
     def add(self, name, value):
         self.definitions[name] = value
@@ -22,13 +33,43 @@ class Context(object):
     def symbol(self, name):
         return self.symbols.get(name)
 
-    def register_symbol(self, name):
-        if name in self.symbols:
-            rand_str = "".join(random.choices(
-                string.ascii_lowercase, k=5))
-            return self.register_symbol(f"{name}_{rand_str}")
-        self.symbols[name] = name
-        return name
+    def taken(self, name):
+        return name in self.symbols or (self.local is not None and name in self.local[0])
+
+    def reserve(self, *names):
+        for name in names:
+            self.symbols[name] = name
+
+    def register_symbol(self, name, glob=False):
+        # Deterministic: the first symbol keeps its name, later ones count
+        # up (name_1, name_2, ...) from where the last allocation stopped.
+        if self.local is not None and not glob:
+            symbols, counters = self.local
+        else:
+            symbols, counters = self.symbols, self.counters
+
+        symbol = name
+        suffix = counters.get(name, 0)
+        while self.taken(symbol):
+            suffix += 1
+            symbol = f"{name}_{suffix}"
+        counters[name] = suffix
+        symbols[symbol] = symbol
+        return symbol
+
+    @contextmanager
+    def function_scope(self, reserved=(), out=None, borrowed=()):
+        # Symbols registered inside are local to one function; numbering
+        # restarts per function, so editing one function never renames
+        # symbols in another.
+        outer = self.local, self.out, self.borrowed
+        self.local = ({name: name for name in reserved}, {})
+        self.out = out
+        self.borrowed = frozenset(borrowed)
+        try:
+            yield self
+        finally:
+            self.local, self.out, self.borrowed = outer
 
     def __repr__(self):
         return f"Context({self.definitions})"
@@ -1,10 +1,132 @@
-import logging
-import sys
+class Span():
+    # Source range of a token or statement: offsets into the source the
+    # lexer ran over (bytes for a mapped file), and the 1 based line and
+    # column of the start
+    __slots__ = ("start", "end", "line", "column")
 
+    def __init__(self, start: int, end: int, line: int, column: int):
+        self.start = start
+        self.end = end
+        self.line = line
+        self.column = column
 
-def throw_compiler_error(msg):
+    def __repr__(self):
+        return f'Span({self.line}:{self.column}, {self.start}-{self.end})'
+
+
+class Diagnostic():
+    __slots__ = ("message", "span", "path")
+
+    def __init__(self, message: str, span: Span = None, path: str = None):
+        self.message = message
+        self.span = span
+        self.path = path
+
+    def __str__(self):
+        location = [self.path] if self.path else []
+        if self.span:
+            location += [str(self.span.line), str(self.span.column)]
+        if not location:
+            return self.message
+        return f'{":".join(location)}: {self.message}'
+
+    def __repr__(self):
+        return f'Diagnostic({self.message!r}, {self.span!r}, {self.path!r})'
+
+
+class CompileError(Exception):
+    # A problem with the program being compiled
+    def __init__(self, message: str, span: Span = None):
+        super().__init__(message, span)
+        self.message = message
+        self.span = span
+        self.path = None
+
+    @property
+    def diagnostics(self) -> list[Diagnostic]:
+        return [Diagnostic(self.message, self.span, self.path)]
+
+    def located(self, path: str):
+        # Attributes the error to a source file
+        self.path = path
+        return self
+
+    def __str__(self):
+        return "\n".join([str(diagnostic) for diagnostic in self.diagnostics])
+
+
+class CompileErrors(CompileError):
+    # Every error one phase found, raised once the phase is done
+    def __init__(self, diagnostics: list[Diagnostic]):
+        super().__init__(f'{len(diagnostics)} errors')
+        self.args = (diagnostics,)
+        self._diagnostics = diagnostics
+
+    @property
+    def diagnostics(self) -> list[Diagnostic]:
+        return self._diagnostics
+
+    def located(self, path: str):
+        for diagnostic in self._diagnostics:
+            diagnostic.path = diagnostic.path or path
+        return self
+
+
+class ReportedError(CompileError):
+    # Raised on using a name whose definition failed. That failure was
+    # reported already, this one adds no diagnostic.
+    def __init__(self, name: str):
+        super().__init__(f'"{name}" failed to check')
+
+    @property
+    def diagnostics(self) -> list[Diagnostic]:
+        return []
+
+
+class Diagnostics():
+    # Collects the errors of one compile so they are all reported at once
+    def __init__(self):
+        self.errors: list[Diagnostic] = []
+        # Statements that failed, ReportedErrors included
+        self.failures = 0
+
+    def error(self, message: str, span: Span = None):
+        self.errors.append(Diagnostic(message, span))
+
+    def add(self, error: CompileError, span: Span = None):
+        # span stands in for errors that do not know their position
+        self.failures += 1
+        for diagnostic in error.diagnostics:
+            diagnostic.span = diagnostic.span or span
+            self.errors.append(diagnostic)
+
+    def check(self):
+        if self.errors:
+            raise CompileErrors(list(self.errors))
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __iter__(self):
+        return iter(self.errors)
+
+
+def span_of(node) -> Span | None:
+    # Nodes made by the parser know where they came from
+    return getattr(node, "span", None)
+
+
+def print_error(msg):
     print("\n\033[91m"+"ERROR:", msg+"\033[0m")
-    sys.exit(1)
+
+
+def throw_compiler_error(msg, span: Span = None):
+    raise CompileError(msg, span)
+
+
+def report(error: CompileError):
+    for diagnostic in error.diagnostics:
+        print_error(str(diagnostic))
 
 
 def print_success(msg: str):
@@ -0,0 +1,226 @@
+from collections import Counter
+
+from src.scope import ScopeEntry
+
+# Flat typed intermediate representation of function bodies, produced once
+# after populate_scope. A body is one list of instructions; a value is the
+# index of the instruction computing it. Values are lowered right before
+# the statement using them and operands always precede their users, so
+# every pass is a forward or backward scan over the list.
+
+# Values
+CONST = "const"                # a: int
+STRING = "string"              # a: str
+LOAD = "load"                  # a: name, b: ScopeEntry
+BINARY = "binary"              # a: operator, args: (left, right)
+GROUP = "group"                # args: (value,), parentheses of the source
+ADDRESS = "address"            # args: (value,)
+DEREF = "deref"                # args: (pointer,)
+FIELD = "field"                # a: field name, args: (pointer,)
+STRUCT = "struct"              # a: struct name, b: member names, args: members
+ARENA_STRUCT = "arena_struct"  # a: struct name, b: (member names, arena, ScopeEntry), args: members
+CALL = "call"                  # a: function name, b: FunctionType, args: arguments
+LIB = "lib"                    # a: LibFunction, b: argument types, args: arguments
+
+# Statements
+LET = "let"                    # a: name, b: ScopeEntry, args: (value,)
+STORE = "store"                # args: (target, value)
+EVAL = "eval"                  # args: (value,)
+RETURN = "return"              # b: arenas to release, args: (value,)
+IF = "if"                      # args: (condition,)
+END = "end"                    # closes the innermost IF
+FREE = "free"                  # a: arena name, b: ScopeEntry
+
+STATEMENTS = frozenset((LET, STORE, EVAL, RETURN, IF, END, FREE))
+# Values with side effects
+EFFECTS = frozenset((CALL, LIB))
+
+INT_MIN, INT_MAX = -2**31, 2**31 - 1
+
+
+class Instr():
+    __slots__ = ("op", "t", "a", "b", "args")
+
+    def __init__(self, op: str, t=None, a=None, b=None, args: tuple[int, ...] = ()):
+        self.op = op
+        # Type of the value; of the variable for LET and of the returned
+        # value for RETURN
+        self.t = t
+        self.a = a
+        self.b = b
+        self.args = args
+
+    def __repr__(self):
+        operands = ", ".join(f"%{arg}" for arg in self.args)
+        return f'{self.op} {self.a if self.a is not None else ""} ({operands}) : {self.t}'
+
+
+class FunctionIR():
+    __slots__ = ("name", "params", "return_type", "code")
+
+    def __init__(self, name: str, params: list, return_type, code: list[Instr]):
+        self.name = name
+        # (name, type) pairs
+        self.params = params
+        self.return_type = return_type
+        self.code = code
+
+    def __repr__(self):
+        lines = "\n".join(f"  %{index} = {instr}" for index, instr in enumerate(self.code))
+        return f'FunctionIR({self.name}, {self.params}) -> {self.return_type}\n{lines}'
+
+
+class Builder():
+    # Collects the instructions of one body while the AST lowers itself
+    def __init__(self):
+        self.code: list[Instr] = []
+        # Arena variables owned by each enclosing block, innermost last
+        self.arenas: list[list[ScopeEntry]] = []
+
+    def emit(self, op: str, t=None, a=None, b=None, args: tuple[int, ...] = ()) -> int:
+        self.code.append(Instr(op, t, a, b, args))
+        return len(self.code) - 1
+
+
+def fold_integers(operator: str, left: int, right: int) -> int | None:
+    # Evaluates like C on 32 bit ints, None where C leaves it undefined
+    if operator == "+":
+        value = left + right
+    elif operator == "-":
+        value = left - right
+    elif operator == "*":
+        value = left * right
+    elif operator == "/":
+        if right == 0:
+            return None
+        value = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            value = -value
+    elif operator == "==":
+        value = int(left == right)
+    else:
+        return None
+    if not INT_MIN <= value <= INT_MAX:
+        return None
+    return value
+
+
+def written(code: list[Instr]) -> set[ScopeEntry]:
+    # Variables that are reassigned or have their address taken
+    entries = set()
+    for instr in code:
+        if instr.op != STORE and instr.op != ADDRESS:
+            continue
+        target = code[instr.args[0]]
+        while target.op == GROUP:
+            target = code[target.args[0]]
+        if target.op == LOAD:
+            entries.add(target.b)
+    return entries
+
+
+def fold(code: list[Instr]):
+    # Evaluates integer arithmetic on constants and propagates lets bound
+    # to a constant that are never written. Operands precede their users,
+    # so one forward scan sees every operand folded already.
+    unstable = written(code)
+    constants: dict[ScopeEntry, int] = {}
+    for instr in code:
+        op = instr.op
+        if op == LOAD:
+            if instr.b in constants:
+                instr.op, instr.a, instr.b = CONST, constants[instr.b], None
+        elif op == BINARY:
+            left, right = code[instr.args[0]], code[instr.args[1]]
+            if left.op == CONST and right.op == CONST:
+                value = fold_integers(instr.a, left.a, right.a)
+                if value is not None:
+                    instr.op, instr.a, instr.args = CONST, value, ()
+        elif op == GROUP:
+            inner = code[instr.args[0]]
+            if inner.op == CONST:
+                instr.op, instr.a, instr.args = CONST, inner.a, ()
+        elif op == LET:
+            value = code[instr.args[0]]
+            if value.op == CONST and instr.b not in unstable:
+                constants[instr.b] = value.a
+
+
+def eliminate_dead_code(code: list[Instr]) -> list[Instr]:
+    # Returns code without unreachable statements, if (0) blocks, side
+    # effect free expression statements, lets nobody reads and the values
+    # only those used.
+    live = [False] * len(code)
+    # Statements whose values call something
+    effects: set[int] = set()
+    effect = False
+    # (depth, whether the END closing it survives) while skipping
+    skip = None
+    depth = 0
+    for index, instr in enumerate(code):
+        op = instr.op
+        if op not in STATEMENTS:
+            if op in EFFECTS:
+                effect = True
+            continue
+        if effect:
+            effects.add(index)
+            effect = False
+        if op == END:
+            if skip and skip[0] == depth:
+                live[index] = skip[1]
+                skip = None
+            elif not skip:
+                live[index] = True
+            depth -= 1
+            continue
+        if op == IF:
+            depth += 1
+        if skip:
+            continue
+        condition = code[instr.args[0]] if op == IF else None
+        if condition and condition.op == CONST and condition.a == 0:
+            skip = (depth, False)
+            continue
+        if op == EVAL and index not in effects:
+            continue
+        live[index] = True
+        if op == RETURN:
+            skip = (depth, True)
+
+    # Backwards: every read of a variable comes after its let, so reads
+    # are all counted when the let is reached, and the reads of a dropped
+    # let are never counted for the lets it reads from.
+    uses = Counter()
+    for index in range(len(code) - 1, -1, -1):
+        if not live[index]:
+            continue
+        instr = code[index]
+        op = instr.op
+        if op == LET and not uses[instr.b] and index not in effects:
+            live[index] = False
+            continue
+        if op == LOAD or op == FREE:
+            uses[instr.b] += 1
+        elif op == ARENA_STRUCT:
+            # The arena is named, not an operand
+            uses[instr.b[2]] += 1
+        for arg in instr.args:
+            live[arg] = True
+
+    if False not in live:
+        return code
+    renumbered = [0] * len(code)
+    kept = []
+    for index, instr in enumerate(code):
+        if live[index]:
+            renumbered[index] = len(kept)
+            if instr.args:
+                instr.args = tuple([renumbered[arg] for arg in instr.args])
+            kept.append(instr)
+    return kept
+
+
+def optimize(function: FunctionIR):
+    fold(function.code)
+    function.code = eliminate_dead_code(function.code)
@@ -0,0 +1,79 @@
+import logging
+
+DRIVER = "driver"
+LEX = "lex"
+PARSE = "parse"
+SCOPE = "scope"
+REFS = "refs"
+CGEN = "cgen"
+
+PHASES = (DRIVER, LEX, PARSE, SCOPE, REFS, CGEN)
+
+_root = logging.getLogger("pitch")
+_root.propagate = False
+_loggers = {phase: _root.getChild(phase) for phase in PHASES}
+
+# Phases with debug output switched on. Checked before any message is
+# built, so a non-debug compile never formats (or repr's) its arguments.
+_enabled: frozenset[str] = frozenset()
+
+
+class LazyMessage():
+    __slots__ = ("args",)
+
+    def __init__(self, args):
+        self.args = args
+
+    def __str__(self):
+        return " ".join([str(arg) for arg in self.args])
+
+
+def configure(debug=False, phases=None):
+    global _enabled
+
+    if not debug:
+        _enabled = frozenset()
+        _root.setLevel(logging.WARNING)
+        return
+
+    phases = PHASES if not phases else phases
+    for phase in phases:
+        if phase not in _loggers:
+            raise ValueError(f"Unknown log phase {phase}")
+    _enabled = frozenset(phases)
+
+    if not _root.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(
+            '%(levelname)s: [%(name)s] %(message)s'))
+        _root.addHandler(handler)
+    _root.setLevel(logging.DEBUG)
+
+
+def enabled(phase=DRIVER):
+    return phase in _enabled
+
+
+def printlog(*args, phase=DRIVER):
+    if phase not in _enabled:
+        return
+    _loggers[phase].info(LazyMessage(args))
+
+
+class PlyLogger():
+    # Error log for ply.lex / ply.yacc: table generation chatter goes to
+    # the phase's debug output, real errors are always reported.
+    def __init__(self, phase):
+        self.phase = phase
+
+    def debug(self, msg, *args, **kwargs):
+        if self.phase in _enabled:
+            _loggers[self.phase].info(msg, *args)
+
+    info = debug
+    warning = debug
+
+    def error(self, msg, *args, **kwargs):
+        _loggers[self.phase].error(msg, *args)
+
+    critical = error
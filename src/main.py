@@ -1,80 +1,167 @@
 
+import io
 import os
-from src.error import print_success, throw_compiler_error
+import threading
+from src.error import CompileError, print_success, throw_compiler_error
+from src.log import CGEN, PARSE, REFS
 from src.nodes.utils import printlog
 import src.pitch_std as std
 from src.pitchparser import PitchParser
+from src.prattparser import PrattParser
 from src.nodes.program import Program
+from src.profiler import PhaseProfiler
+from src.source import Source
 from prettyprinter import pprint
-import logging
 from src.context import Context
 
-logging.basicConfig(format='%(levelname)s: %(message)s', level=logging.DEBUG)
+
+# Parsers selectable with --parser, all build the same tree
+PARSERS = {"lalr": PitchParser, "pratt": PrattParser}
+
+
+class Result():
+    # What compiling one program gives: the analyzed tree and its C
+    __slots__ = ("program", "c")
+
+    def __init__(self, program: Program, c: str):
+        self.program = program
+        self.c = c
+
+    def __repr__(self):
+        return f'Result({len(self.c)} chars of C)'
 
 
 class PitchCompiler():
-    def __init__(self, source_file: str = None, out_path=None, debug=False):
+    def __init__(self, source_file: str = None, out_path=None, debug=False, log_phases=None, profiler: PhaseProfiler = None, parser="lalr"):
+        # Logging is the host's to configure (compile.py, project workers),
+        # a compiler leaves it as it is
         self.debug = debug
+        self.parser_kind = parser
         self.source_file = source_file
         self.out_dir = out_path
+        self.profiler = profiler or PhaseProfiler()
+        self._parser = None
 
-    def compile(self):
-
-        if self.source_file is None:
-            throw_compiler_error("No source file specified")
+    @property
+    def parser(self) -> PitchParser | PrattParser:
+        if not self._parser:
+            self._parser = PARSERS[self.parser_kind]()
+        return self._parser
 
-        source = ""
+    def parse(self, source) -> Program:
+        if not self._parser:
+            with self.profiler.phase("load_tables"):
+                self._parser = PARSERS[self.parser_kind]()
 
-        with open(self.source_file, "r") as f:
-            source = f.read()
-            f.close()
-
-        parser = PitchParser(self.out_dir)
-        parse_tree: Program = parser.parse(source)
-        # printlog("RECURSIVE?", pprint.isrecursive(parse_tree))
+        with self.profiler.phase("parse") as record:
+            parse_tree: Program = self.parser.parse(source)
+            record.tree = parse_tree
 
         if not parse_tree:
             throw_compiler_error("No parse tree generated")
-        else:
-            print_success("Parse tree generated")
-            print(parse_tree)
+        printlog(parse_tree, phase=PARSE)
 
         definitions = {}
 
-        parse_tree.preprocess(definitions)
+        with self.profiler.phase("preprocess", parse_tree):
+            parse_tree.preprocess(definitions)
 
-        printlog("Defs", definitions)
+        printlog("Defs", definitions, phase=PARSE)
+        return parse_tree
 
+    def analyze(self, parse_tree: Program, modules=None):
         libs = [std.Alloc()]
 
-        parse_tree.populate_scope(libs)
+        with self.profiler.phase("populate_scope", parse_tree):
+            parse_tree.populate_scope(libs, modules)
 
         # parse_tree.typecheck()
         # parse_tree.expand()
         # parse_tree.validate_branches()
         context = Context()
-        parse_tree.check_references(context)
-        print("PT", parse_tree)
-        print(parse_tree)
-        printlog("")
-        c_tree = parse_tree.generate_c()
-        if not c_tree:
-            throw_compiler_error("No C tree generated")
-        else:
-            print_success("\nC tree generated\n")
-        c = c_tree.to_string()
-        printlog(c)
-
-        assert (c_tree is not None)
-        # assert (type(c_tree) == cgen.CProgram)
-
-        # c = parse_tree.to_c()
-        # printlog(c)
+        with self.profiler.phase("check_references", parse_tree):
+            parse_tree.check_references(context)
+        printlog("PT", parse_tree, phase=REFS)
+
+        with self.profiler.phase("inline", parse_tree):
+            parse_tree.inline()
+
+        with self.profiler.phase("lower", parse_tree):
+            parse_tree.lower()
+
+        with self.profiler.phase("optimize"):
+            parse_tree.optimize()
+
+    def generate(self, parse_tree: Program, out: io.TextIOBase, exported: set[str] | None = None,
+                 header: str | None = None):
+        printlog("Generating C", phase=CGEN)
+        with self.profiler.phase("generate_c", parse_tree):
+            parse_tree.generate_c(out, exported, header)
+
+    def build(self, source) -> Program:
+        # Parses and analyzes source text (or a UTF-8 buffer), raising
+        # CompileError with the diagnostics on failure
+        try:
+            parse_tree = self.parse(source)
+            self.analyze(parse_tree)
+        except CompileError as error:
+            raise error.located(self.source_file)
+        except RecursionError:
+            # The phases walk the tree recursively
+            raise CompileError("Program nested too deeply").located(self.source_file)
+        return parse_tree
+
+    def compile_source(self, source, exported: set[str] | None = None) -> Result:
+        # Compiles without touching files or stdout. By default the
+        # program is whole, only main is called from outside.
+        parse_tree = self.build(source)
+        out = io.StringIO()
+        self.generate(parse_tree, out, exported={"main"} if exported is None else exported)
+        return Result(parse_tree, out.getvalue())
+
+    def compile(self):
+
+        if self.source_file is None:
+            throw_compiler_error("No source file specified")
+
+        self.profiler.start()
+        with self.profiler.phase("read"):
+            source = Source(self.source_file)
+
+        with source:
+            parse_tree = self.build(source.buffer)
+        print_success("Parse tree generated")
 
         if not os.path.isdir(self.out_dir):
             os.makedirs(self.out_dir)
 
         c_file_out = os.path.join(self.out_dir, "out.c")
 
+        # A single file is the whole program, only main is called from
+        # outside. The C is streamed into the file as it is generated.
         with open(c_file_out, "w") as f:
-            f.write(c)
+            self.generate(parse_tree, f, exported={"main"})
+        print_success("\nC generated\n")
+
+        self.profiler.stop()
+        if self.profiler.enabled:
+            print(self.profiler.report())
+
+
+# One compiler per parser kind, kept for the life of the process so the
+# parse tables and lexer are built once, not per compile_string call.
+# The parsers keep per parse state, the lock runs one compile at a time.
+_compilers: dict[str, PitchCompiler] = {}
+_lock = threading.Lock()
+
+
+def compile_string(source: str, parser: str = "lalr", exported: set[str] | None = None) -> Result:
+    # Library entry point: nothing is printed or written, and errors are
+    # raised as CompileError, with every diagnostic of the compile.
+    if parser not in PARSERS:
+        raise ValueError(f'Unknown parser "{parser}", expected one of {", ".join(PARSERS)}')
+    with _lock:
+        compiler = _compilers.get(parser)
+        if compiler is None:
+            compiler = _compilers[parser] = PitchCompiler(parser=parser)
+        return compiler.compile_source(source, exported)
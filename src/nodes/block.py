@@ -1,31 +1,34 @@
-from weakref import ReferenceType
-from src import cgen
+from src import cgen, ir
 from src.nodes.utils import Base
-from src.pitchtypes import FunctionType, StructType,  TypeBase, UnresolvedType, VoidType, resolve_with_scope
+from src.pitchtypes import FunctionType, StructType,  TypeBase, VoidType, resolve_with_scope
 from src.error import throw_compiler_error
 from src.nodes.expressions import Expression
-from src.nodes.statements import StatementBase, StatementList
+from src.nodes.statements import Return, StatementBase, StatementList
 from src.nodes.utils import printlog
+from src.log import PARSE, REFS, SCOPE
 from src.scope import Scope, ScopeEntry
 
 
 class Parameter():
+    __slots__ = ("type", "id", "entry")
+
     def __init__(self, type: str, id: str):
-        printlog("init param", type, id)
+        printlog("init param", type, id, phase=PARSE)
         self.type: TypeBase = type
         self.id = id
+        self.entry: ScopeEntry = None
 
     def __repr__(self):
         return f'{self.id=}: {self.type=}'
 
     def compute_type(self, scope: Scope):
-        type = resolve_with_scope(self.type, scope)
-        if not type:
-            throw_compiler_error(f'Could not resolve type {self.type.id}')
-        return type
+        self.type = resolve_with_scope(self.type, scope)
+        return self.type
 
 
 class ParameterList(Base):
+    __slots__ = ("parameters",)
+
     def __init__(self, parameters: list[Parameter]):
         self.parameters = parameters
 
@@ -36,11 +39,10 @@ class ParameterList(Base):
         self.parameters.append(parameter)
         return self
 
-    def generate_c(self, writer, context):
-        return ", ".join([f'{parameter.type.to_c()} {parameter.id}' for parameter in self.parameters])
-
 
 class Block(Base):
+    __slots__ = ("statement_list", "parent_function", "scope", "returns")
+
     def __init__(self, statement_list: StatementList, parent_function=None) -> None:
         self.statement_list: StatementList = statement_list
         self.parent_function: Function = parent_function
@@ -54,8 +56,8 @@ class Block(Base):
 
         self.scope = Scope("__block__", scope, inject=inject)
         self.statement_list.populate_scope(self.scope, self)
-        printlog(f"Block scope after pop {
-            self.scope}, {self.scope.parent}")
+        printlog("Block scope after pop", self.scope,
+                 self.scope.parent, phase=SCOPE)
 
     def find(self, id):
         return self.statement_list.find(id)
@@ -81,17 +83,26 @@ class Block(Base):
     def __repr__(self):
         return f'Block({repr(self.statement_list)}, ret={repr(self.returns)})'
 
-    def generate_c(self, writer: cgen.CWriter, context):
+    def lower(self, builder: ir.Builder):
+        builder.arenas.append([])
         for statement in self.statement_list.statements:
-            statement.generate_c(writer, context)
-            printlog("statement", statement)
-        printlog(writer.statements)
+            statement.lower(builder)
+
+        # Arenas die with the block that created them. A trailing return
+        # already released them.
+        arenas = builder.arenas.pop()
+        statements = self.statement_list.statements
+        if not statements or not isinstance(statements[-1], Return):
+            for arena in reversed(arenas):
+                builder.emit(ir.FREE, a=arena.name, b=arena)
 
     def check_references(self, context):
         self.statement_list.check_references(context)
 
 
 class NamedBlock(Base):
+    __slots__ = ("name", "block")
+
     def __init__(self, name: str, block: Block):
         self.name = name
         self.block = block
@@ -105,11 +116,13 @@ class NamedBlock(Base):
     def find(self, id):
         return self.block.find(id)
 
-    def generate_c(self, writer, context):
-        self.block.generate_c(writer, context)
+    def lower(self, builder: ir.Builder):
+        self.block.lower(builder)
 
 
 class Function(Base):
+    __slots__ = ("id", "return_type", "params", "block", "scope", "return_types", "span")
+
     def __init__(self, id: str, params: ParameterList | None, return_type: str,  block: Block):
         self.id = id
         self.return_type: TypeBase = return_type
@@ -125,9 +138,11 @@ class Function(Base):
 
     def populate_scope(self, scope, _: Block):
         printlog("populating scope for function",
-                 self.id, self.return_type)
+                 self.id, self.return_type, phase=SCOPE)
         self.block.parent_function = self
-        printlog("params", self.params)
+        printlog("params", self.params, phase=SCOPE)
+
+        self.return_type = resolve_with_scope(self.return_type, scope)
 
         if self.params:
             for param in self.params.parameters:
@@ -144,13 +159,16 @@ class Function(Base):
         scope_injections: list[ScopeEntry] = []
         if self.params:
             for param in self.params.parameters:
-                scope_injections.append(ScopeEntry(param.id, param.type))
+                param.entry = ScopeEntry(param.id, param.type)
+                scope_injections.append(param.entry)
 
+        failures = scope.diagnostics.failures
         self.block.populate_scope(scope, self.block, inject=scope_injections)
 
-        printlog(self.return_types)
+        printlog(self.return_types, phase=SCOPE)
 
-        if isinstance(self.return_type, VoidType):
+        # Failed statements are missing from return_types
+        if isinstance(self.return_type, VoidType) or scope.diagnostics.failures > failures:
             return
 
         if len(self.return_types) == 0:
@@ -159,7 +177,7 @@ class Function(Base):
 
         # Check if all possible returnt types are the same
 
-        if len(set(self.return_types)) > 1:
+        if any(not t.equal_to(self.return_types[0]) for t in self.return_types):
             throw_compiler_error(
                 f'Function "{self.id}" has multiple return types')
 
@@ -167,29 +185,21 @@ class Function(Base):
             throw_compiler_error(
                 f'Function "{self.id}" has return type {self.return_types[0]}, but declared as {self.return_type}')
         self.return_type = self.return_types[0]
-        printlog(f"Done with function {self.id}, return type {
-                 self.return_type} {self.return_types}")
-
-    def generate_c(self, top_level_writer: cgen.CWriter, context) -> cgen.CFunction:
-        printlog("C ing function")
-        # Maybe make a function writer and let the function arguments do stuff in the body
-        c_function = cgen.CFunction(
-            name=self.id, return_type=self.return_type.to_c(), args=self.params.generate_c(top_level_writer, context), root=None, parent=None
-        )
-        function_writer = cgen.CWriter(top_level_writer)
-
-        self.block.generate_c(function_writer, context)
-
-        c_function.body.statements = function_writer.export()
+        printlog("Done with function", self.id, "return type",
+                 self.return_type, self.return_types, phase=SCOPE)
 
-        top_level_writer.append(c_function)
-        printlog("writer", function_writer.statements)
+    def lower(self) -> ir.FunctionIR:
+        builder = ir.Builder()
+        self.block.lower(builder)
+        return ir.FunctionIR(self.id, [(param.id, param.type) for param in self.params.parameters],
+                             self.return_type, builder.code)
 
     def check_references(self, context):
         self.block.check_references(context)
 
 
 class If(StatementBase):
+    __slots__ = ("condition", "block")
 
     def __init__(self, condition: Expression, block: Block):
         self.condition = condition
@@ -206,30 +216,26 @@ class If(StatementBase):
     def find(self, id):
         return self.block.find(id)
 
-    def generate_c(self, level=0):
-        return f'if ({self.condition.to_c()}) {{\n{self.block.to_c(level+1)}\n{"    "*(level+1)}}}'
+    def lower(self, builder: ir.Builder):
+        builder.emit(ir.IF, args=(self.condition.lower(builder),))
+        self.block.lower(builder)
+        builder.emit(ir.END)
 
     def check_references(self, context):
-        printlog("checking referencess...")
+        printlog("checking referencess...", phase=REFS)
 
 
 class StructMember(Base):
+    __slots__ = ("type", "id")
+
     def __init__(self, type: str, id: str):
-        printlog(id,  type)
+        printlog(id,  type, phase=PARSE)
         self.type: TypeBase = type
         self.id = id
 
     def compute_type(self, scope: Scope, stuct_id: str):
-        printlog("computing type", self.type)
-        if isinstance(self.type, UnresolvedType):
-            type = scope.find(self.type.name)
-            if not type:
-                throw_compiler_error(
-                    f'Could not resolve type {self.type.id}')
-            self.type = type.type
-        if isinstance(self.type, ReferenceType):
-            self.type.to = resolve_with_scope(self.type.to, scope)
-
+        printlog("computing type", self.type, phase=SCOPE)
+        self.type = resolve_with_scope(self.type, scope)
         return self.type
 
     def __repr__(self):
@@ -237,6 +243,8 @@ class StructMember(Base):
 
 
 class Struct(Base):
+    __slots__ = ("id", "member_list", "span")
+
     def __init__(self, id: str, members):
         self.id = id
         self.member_list: list[StructMember] = members
@@ -246,14 +254,19 @@ class Struct(Base):
 
     def populate_scope(self, scope: Scope, _: Block):
 
-        printlog("POPULATE SCOPE STRUCT")
-        printlog(self.member_list)
+        printlog("POPULATE SCOPE STRUCT", phase=SCOPE)
+        printlog(self.member_list, phase=SCOPE)
         member_types = {}
-        for member in self.member_list:
-            member_types[member.id] = member.compute_type(scope, self.id)
+        # Members may point back at the struct being declared
+        scope.types.declaring.add(self.id)
+        try:
+            for member in self.member_list:
+                member_types[member.id] = member.compute_type(scope, self.id)
+        finally:
+            scope.types.declaring.discard(self.id)
         struct_type = StructType(self.id, member_types)
         scope.add(self.id, struct_type)
-        printlog("struct type", struct_type)
+        printlog("struct type", struct_type, phase=SCOPE)
 
     def generate_c(self, top_level_writer: cgen.CWriter, context):
         member_list_c = "\n    ".join(
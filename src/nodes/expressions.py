@@ -1,19 +1,24 @@
+import sys
 from abc import ABC, abstractmethod, abstractproperty
-from src.context import Context, ContextVar
-from src.error import throw_compiler_error
-from src.pitchtypes import FunctionType, IntType, LocalStringType, ReferenceType, StructType, TypeBase, UnknownType
+from src.error import ReportedError, throw_compiler_error
+from src.pitchtypes import ArenaType, ErrorType, FunctionType, IntType, LocalStringType, ReferenceType, StructType, TypeBase, UnknownType
 from src.scope import Scope, ScopeEntry
-import src.cgen as cgen
+from src import ir
+from src.log import SCOPE
 from src.nodes.utils import printlog, Base
 
 
 class ExpressionBase(Base):
+    __slots__ = ("t",)
+
     @abstractmethod
     def compute_type(self, scope):
         pass
 
     @abstractmethod
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None) -> str:
+    def lower(self, builder: ir.Builder) -> int:
+        # Emits the instructions computing the expression, returns the
+        # index of its value
         pass
 
     @abstractmethod
@@ -22,10 +27,12 @@ class ExpressionBase(Base):
 
 
 class Expression(ExpressionBase):
+    __slots__ = ("left", "right", "operator")
+
     def __init__(self, left: ExpressionBase, right: ExpressionBase, operator: str):
         self.left = left
         self.right = right
-        self.operator = operator
+        self.operator = sys.intern(operator)
         self.t: TypeBase = None
 
     def __repr__(self):
@@ -34,16 +41,21 @@ class Expression(ExpressionBase):
     def compute_type(self, scope) -> TypeBase:
         # TODO check if types compatible
         self.t = self.left.compute_type(scope)
+        self.right.compute_type(scope)
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return f'{self.left.generate_c(writer, context)} {self.operator} {self.right.generate_c(writer, context)}'
+    def lower(self, builder: ir.Builder):
+        left = self.left.lower(builder)
+        right = self.right.lower(builder)
+        return builder.emit(ir.BINARY, self.t, self.operator, args=(left, right))
 
     def evaluates_to(self):
         return "value"
 
 
 class Group(Expression):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: ExpressionBase):
         self.expression = expression
         self.t: TypeBase = None
@@ -55,14 +67,16 @@ class Group(Expression):
         self.t = self.expression.compute_type(scope)
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return f'({self.expression.generate_c(writer, context)})'
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.GROUP, self.t, args=(self.expression.lower(builder),))
 
     def evaluates_to(self):
         return self.expression.evaluates_to()
 
 
 class Integer(ExpressionBase):
+    __slots__ = ("value", "size")
+
     def __init__(self, value: int, size: int):
         self.value = value
         self.size = size
@@ -75,14 +89,16 @@ class Integer(ExpressionBase):
         self.t = IntType(self.size)
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return str(self.value)
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.CONST, self.t, self.value)
 
     def evaluates_to(self):
         return "value"
 
 
 class String(ExpressionBase):
+    __slots__ = ("value",)
+
     def __init__(self, value: str):
         self.value = value.replace('"', '')
         self.t: LocalStringType = None
@@ -91,42 +107,47 @@ class String(ExpressionBase):
         return f'String(value={self.value})'
 
     def compute_type(self, scope):
-        self.t = LocalStringType(len(self.value))
+        self.t = LocalStringType()
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        writer.append_statement(f"// {role}")
-        # Add factory
-        # return self.t.generate_c_static(self.value, )
-        return cgen.PitchString(self.value, self.t.size).to_const(writer, context)
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.STRING, self.t, self.value)
 
     def evaluates_to(self):
         return "value"
 
 
 class Identifier(ExpressionBase):
+    __slots__ = ("id", "entry")
 
     def __init__(self, id: str):
         self.id = id
         self.t: TypeBase = None
+        self.entry: ScopeEntry = None
 
     def __repr__(self):
         return f'Identifier({self.id})'
 
     def compute_type(self, scope: Scope):
-        if not scope.find(self.id):
+        entry = scope.find(self.id)
+        if not entry:
             throw_compiler_error(f'Identifier "{self.id}" not found')
-        self.t = scope.find(self.id).type
+        if isinstance(entry.type, ErrorType):
+            raise ReportedError(self.id)
+        self.entry = entry
+        self.t = entry.type
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return self.id
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.LOAD, self.t, self.id, self.entry)
 
     def evaluates_to(self):
         return "identifier"
 
 
 class Reference(ExpressionBase):
+    __slots__ = ("id",)
+
     def __init__(self, id: str):
         self.id: Identifier = id
         self.t: TypeBase = None
@@ -141,14 +162,16 @@ class Reference(ExpressionBase):
             throw_compiler_error("Cannot reference expression")
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return f'&{self.id.generate_c(writer, context)}'
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.ADDRESS, self.t, args=(self.id.lower(builder),))
 
     def evaluates_to(self):
         return "reference"
 
 
 class Dereference(ExpressionBase):
+    __slots__ = ("id",)
+
     def __init__(self, id: str):
         self.id: Identifier = id
         self.t: TypeBase = None
@@ -158,20 +181,21 @@ class Dereference(ExpressionBase):
 
     def compute_type(self, scope):
         id_type: TypeBase = self.id.compute_type(scope)
-        if id_type != ReferenceType:
+        if not isinstance(id_type, ReferenceType):
             throw_compiler_error("Cannot dereference non-reference")
-        assert isinstance(id_type, ReferenceType)
         self.t = id_type.to
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return f'*{self.id.generate_c(writer, context)}'
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.DEREF, self.t, args=(self.id.lower(builder),))
 
     def evaluates_to(self):
         return "identifier"
 
 
 class FieldDereference(ExpressionBase):
+    __slots__ = ("expression", "field")
+
     def __init__(self, expression: ExpressionBase, field: str):
         self.expression = expression
         self.field = field
@@ -182,14 +206,14 @@ class FieldDereference(ExpressionBase):
 
     def compute_type(self, scope):
         ref_struct_type = self.expression.compute_type(scope)
-        printlog("Ref struct type", ref_struct_type)
+        printlog("Ref struct type", ref_struct_type, phase=SCOPE)
 
         if not isinstance(ref_struct_type, ReferenceType):
             throw_compiler_error(
                 f'Cannot dereference non-reference type {ref_struct_type}')
 
         struct_type: StructType = ref_struct_type.to
-        printlog("Struct type", struct_type)
+        printlog("Struct type", struct_type, phase=SCOPE)
 
         if not isinstance(struct_type, StructType):
             throw_compiler_error(
@@ -204,14 +228,16 @@ class FieldDereference(ExpressionBase):
         self.t = field_type
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        return f'{self.expression.generate_c(writer, context)}->{self.field}'
+    def lower(self, builder: ir.Builder):
+        return builder.emit(ir.FIELD, self.t, self.field, args=(self.expression.lower(builder),))
 
     def evaluates_to(self):
         return "identifier"
 
 
 class StructInitMember(ExpressionBase):
+    __slots__ = ("id", "value")
+
     def __init__(self, id: str, expression: ExpressionBase):
         self.id = id
         self.value = expression
@@ -223,22 +249,26 @@ class StructInitMember(ExpressionBase):
     def compute_type(self, scope):
         pass
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None):
-        pass
+    def lower(self, builder: ir.Builder):
+        return self.value.lower(builder)
 
     def evaluates_to(self):
         return "identifier"
 
 
 class StructInit(ExpressionBase):
-    def __init__(self, id: str, members: list, alloc: bool = False):
+    __slots__ = ("id", "members", "alloc", "arena", "arena_entry")
+
+    def __init__(self, id: str, members: list, alloc: bool = False, arena: str = None):
         self.id = id
         self.members = members
         self.alloc = alloc
+        self.arena = arena
+        self.arena_entry: ScopeEntry = None
         self.t: TypeBase = None
 
     def __repr__(self):
-        return f'StructInitializer({self.id}, {self.members})'
+        return f'StructInitializer({self.id}, {self.members}, arena={self.arena})'
 
     def compute_type(self, scope: Scope):
 
@@ -249,7 +279,16 @@ class StructInit(ExpressionBase):
         if not struct_init_type:
             throw_compiler_error(f'Identifier "{self.id}" not found')
 
-        if self.alloc:
+        if self.arena:
+            arena = scope.find(self.arena)
+            if arena and isinstance(arena.type, ErrorType):
+                raise ReportedError(self.arena)
+            if not arena or not isinstance(arena.type, ArenaType):
+                throw_compiler_error(
+                    f'"{self.arena}" is not an arena, cannot allocate {self.id} in it')
+            self.arena_entry = arena
+            self.t = ReferenceType(struct_init_type.type, scope="arena")
+        elif self.alloc:
             self.t = ReferenceType(
                 struct_init_type.type, scope="global")
         else:
@@ -257,20 +296,12 @@ class StructInit(ExpressionBase):
 
         return self.t
 
-    def generate_c(self, writer: cgen.CWriter, context: Context, role=None) -> str:
-        struct_member_c = []
-        for member in self.members:
-            struct_member_c.append(
-                f'.{member.id}={member.value.generate_c(writer, context, role="struct.init")}')
-        # if self.alloc:
-        #    tmp = context.register_symbol("tmp")
-        #    writer.append(cgen.CStatement(f'{self.t.to_c()} {tmp} = ({
-        #                  self.t.to.to_c()}*)malloc(sizeof({self.t.to.to_c()}));'))
-        #    writer.append(cgen.CStatement(
-        #        f'*{tmp} = ({self.t.to.to_c()}) {{ {", ".join(struct_member_c)} }};'))
-        #    return tmp
-        # else:
-        return f"(struct {self.id}){{ {", ".join(struct_member_c)} }}"
+    def lower(self, builder: ir.Builder):
+        names = tuple(member.id for member in self.members)
+        args = tuple(member.lower(builder) for member in self.members)
+        if self.arena:
+            return builder.emit(ir.ARENA_STRUCT, self.t, self.id, (names, self.arena, self.arena_entry), args)
+        return builder.emit(ir.STRUCT, self.t, self.id, names, args)
 
     def evaluates_to(self):
         return "identifier"
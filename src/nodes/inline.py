@@ -0,0 +1,173 @@
+import copy
+import itertools
+
+from src.log import SCOPE
+from src.nodes.block import Block, Function
+from src.nodes.expressions import Identifier, StructInit
+from src.nodes.statements import Assignment, Call, ExpressionStatement, Reassignment, Return, pure
+from src.nodes.utils import children, printlog, walk
+from src.scope import ScopeEntry
+
+# Largest callee body, in AST nodes, that is copied into its callers
+INLINE_SIZE = 40
+
+
+def clone(value, entries: dict[ScopeEntry, ScopeEntry]):
+    # Copies a subtree; identifiers bound to a key of entries are rebound
+    # to its value. Types, scope entries and strings are shared.
+    if isinstance(value, list):
+        return [clone(item, entries) for item in value]
+    if not type(value).__module__.startswith("src.nodes."):
+        return value
+    node = copy.copy(value)
+    for name, child in children(value):
+        setattr(node, name, clone(child, entries))
+    if isinstance(node, Identifier) and node.entry in entries:
+        node.entry = entries[node.entry]
+        node.id = node.entry.name
+    return node
+
+
+class Inliner():
+    # Replaces calls to small, straight-line, side effect free functions
+    # by a copy of their body. Callers are processed after their callees,
+    # so inlined bodies are already flat; functions on a call graph cycle
+    # are never inlined.
+    def __init__(self, functions: list[Function], reserved=()):
+        self.functions = {function.id: function for function in functions}
+        self.reserved = set(reserved)
+        self.calls: dict[str, set[str]] = {}
+        self.recursive: set[str] = set()
+        self.inlinable: set[str] = set()
+
+    def cycles(self) -> set[str]:
+        # Functions that can reach themselves through calls
+        recursive = set()
+        for name in self.functions:
+            seen = set()
+            stack = list(self.calls[name])
+            while stack:
+                callee = stack.pop()
+                if callee == name:
+                    recursive.add(name)
+                    break
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.extend(self.calls[callee])
+        return recursive
+
+    def order(self) -> list[str]:
+        # Callees before callers (post order over the call graph)
+        order = []
+        seen = set()
+        for root in self.functions:
+            stack = [(root, iter(sorted(self.calls[root])))]
+            if root in seen:
+                continue
+            seen.add(root)
+            while stack:
+                name, callees = stack[-1]
+                callee = next(callees, None)
+                if callee is None:
+                    stack.pop()
+                    order.append(name)
+                elif callee not in seen:
+                    seen.add(callee)
+                    stack.append((callee, iter(sorted(self.calls[callee]))))
+        return order
+
+    def small(self, function: Function) -> bool:
+        # Straight-line body within the size limit
+        *lets, last = function.block.statement_list.statements or [None]
+        if not isinstance(last, Return) or not all(isinstance(let, Assignment) for let in lets):
+            return False
+        return len(list(itertools.islice(walk(function.block), INLINE_SIZE + 1))) <= INLINE_SIZE
+
+    def can_inline(self, function: Function) -> bool:
+        if function.id in self.recursive or function.id == "main" or not self.small(function):
+            return False
+        nodes = list(walk(function.block))
+        # Arena allocations name their arena by identifier string
+        if any(isinstance(node, StructInit) and node.arena for node in nodes):
+            return False
+        return all(pure(statement.expression)
+                   for statement in function.block.statement_list.statements)
+
+    def run(self):
+        # Inlining never shrinks a function, so without small functions
+        # up front there is nothing to do
+        if not any(self.small(function) for function in self.functions.values()
+                   if function.id != "main"):
+            return
+
+        self.calls = {name: {node.id for node in walk(function.block)
+                             if isinstance(node, Call) and node.id in self.functions}
+                      for name, function in self.functions.items()}
+        self.recursive = self.cycles()
+        for name in self.order():
+            function = self.functions[name]
+            if self.calls[name] & self.inlinable:
+                self.inline_into(function)
+            if self.can_inline(function):
+                self.inlinable.add(name)
+        printlog("Inlinable functions", sorted(self.inlinable), phase=SCOPE)
+
+    def inline_into(self, function: Function):
+        taken = self.reserved | {param.id for param in function.params.parameters} | \
+            {node.id for node in walk(function.block) if isinstance(node, (Identifier, Assignment))}
+        counter = [0]
+
+        for block in [node for node in walk(function.block) if isinstance(node, Block)]:
+            statements = []
+            for statement in block.statement_list.statements:
+                if isinstance(statement, (Assignment, Return, ExpressionStatement, Reassignment)):
+                    while self.inline_call(statement, statements, taken, counter):
+                        pass
+                statements.append(statement)
+            block.statement_list.statements = statements
+
+    def inline_call(self, statement, statements: list, taken: set[str], counter: list[int]) -> bool:
+        # Inlines the first eligible call of statement, the callee's lets
+        # are appended to statements. Returns whether a call was inlined.
+        for parent in walk(statement):
+            for name, child in children(parent):
+                if isinstance(child, Call) and self.eligible(child):
+                    setattr(parent, name, self.expand(child, statements, taken, counter))
+                    return True
+                if isinstance(child, list):
+                    for index, item in enumerate(child):
+                        if isinstance(item, Call) and self.eligible(item):
+                            child[index] = self.expand(item, statements, taken, counter)
+                            return True
+        return False
+
+    def eligible(self, call: Call) -> bool:
+        args = call.args.expressions if call.args else []
+        callee = self.functions.get(call.id)
+        return call.id in self.inlinable and not call.lib and \
+            len(args) == len(callee.params.parameters) and all(pure(arg) for arg in args)
+
+    def expand(self, call: Call, statements: list, taken: set[str], counter: list[int]):
+        callee = self.functions[call.id]
+        counter[0] += 1
+        while any(name.startswith(f"{call.id}{counter[0]}_") for name in taken):
+            counter[0] += 1
+        prefix = f"{call.id}{counter[0]}_"
+        entries: dict[ScopeEntry, ScopeEntry] = {}
+
+        def let(id, expression, t, entry: ScopeEntry):
+            assignment = Assignment(prefix + id, expression, t)
+            assignment.entry = ScopeEntry(assignment.id, t)
+            entries[entry] = assignment.entry
+            taken.add(assignment.id)
+            statements.append(assignment)
+
+        args = call.args.expressions if call.args else []
+        for param, arg in zip(callee.params.parameters, args):
+            let(param.id, arg, param.type, param.entry)
+
+        *lets, result = callee.block.statement_list.statements
+        for assignment in lets:
+            let(assignment.id, clone(assignment.expression, entries), assignment.t, assignment.entry)
+        printlog("Inlined", call.id, "as", prefix, phase=SCOPE)
+        return clone(result.expression, entries)
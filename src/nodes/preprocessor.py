@@ -9,12 +9,15 @@ from src.nodes.utils import printlog, Base
 
 
 class PreprocessorBase(Base):
+    __slots__ = ()
+
     @abstractmethod
     def preprocess(self, definitions):
         pass
 
 
 class DefStatement():
+    __slots__ = ("id",)
 
     def __init__(self, id: str):
         self.id = id
@@ -36,6 +39,7 @@ class DefStatement():
 
 
 class DefDefinition():
+    __slots__ = ("id", "def_for", "expression")
 
     def __init__(self, id: str, def_for: str, expression: Expression):
         self.id = id
@@ -60,6 +64,7 @@ class DefDefinition():
 
 
 class CompCall(ExpressionBase):
+    __slots__ = ("id", "arguments")
 
     TYPES = {"print_i": "void"}
 
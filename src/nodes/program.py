@@ -1,14 +1,20 @@
-
-from src import cgen
+import io
+from src import backend, cgen, ir
 from src.context import Context
-from src.nodes.statements import ImportStatement
-from src.nodes.utils import Base
-from src.nodes.block import Function
+from src.error import CompileError, Diagnostics, span_of, throw_compiler_error
+from src.nodes.statements import ImportStatement, StatementBase
+from src.log import SCOPE
+from src.nodes.utils import Base, printlog
+from src.nodes.block import Function, Struct
+from src.pitchtypes import LocalStringType
+from src.nodes.inline import Inliner
 from src.nodes.preprocessor import PreprocessorBase
 from src.scope import Scope
+import src.pitch_std as std
 
 
 class Program(Base):
+    __slots__ = ("statements", "functions", "preprocessor_statements", "scope", "lowered")
 
     def __init__(self, statements: list):
         # TODO add var statements. Do preprocessing. then make var functions.
@@ -16,6 +22,9 @@ class Program(Base):
         self.functions: list[Function] = []
         self.preprocessor_statements: list[PreprocessorBase] = None
         self.scope = None
+        # IR of each statement: FunctionIR for functions, the instructions
+        # of other statements, None for declarations
+        self.lowered: list[ir.FunctionIR | list[ir.Instr] | None] = None
 
     def append(self, statement):
         self.statements.append(statement)
@@ -31,31 +40,107 @@ class Program(Base):
             elif isinstance(statement, Function):
                 self.functions.append(statement)
 
-    def populate_scope(self, libs):
-        assert (len(self.functions) > 0)
-        self.scope = Scope("__program__")
+    def populate_scope(self, libs, modules=None, diagnostics: Diagnostics = None):
+        # Raises CompileErrors with every error found, each statement is
+        # checked even if an earlier one failed
+        if not self.functions:
+            throw_compiler_error("Program defines no functions")
+        self.scope = Scope("__program__", diagnostics=diagnostics)
+        for builtin in std.BUILTINS:
+            self.scope.add(builtin.name, builtin.t, lib=builtin)
         for statement in self.statements:
             if isinstance(statement, ImportStatement):
-                print("resolving imports")
-                statement.resolve_imports(self.scope, libs)
+                printlog("resolving imports", phase=SCOPE)
+                statement.resolve_imports(self.scope, libs, modules or {})
 
         for stm in self.statements:
-            stm.populate_scope(self.scope, None)
+            try:
+                stm.populate_scope(self.scope, None)
+            except CompileError as error:
+                self.scope.diagnostics.add(error, span_of(stm))
+        self.scope.diagnostics.check()
 
-    def generate_c(self):
-        top_level = cgen.CProgram()
-        top_level_writer = cgen.CWriter()
+    def generate_c(self, out: io.TextIOBase, exported: set[str] | None = None, header: str | None = None):
+        # Functions not in exported (default all) are only called from
+        # this program and get internal linkage. A module of a project
+        # includes its own header, which declares its structs.
+        emitter = cgen.CEmitter(out)
+        top_level_writer = cgen.CWriter(emitter=emitter)
         context = Context()
         top_level_writer.add_import("stdio.h")
         top_level_writer.add_import("stdint.h")
         top_level_writer.add_import("stdbool.h")
+        if header:
+            top_level_writer.add_import(header, local=True)
+        context.reserve(*[statement.id for statement in self.statements
+                          if isinstance(statement, (Function, Struct))])
+        context.storage = {function.id: "" if exported is None or function.id in exported
+                           else "static inline " for function in self.functions}
+
+        # Includes have to come first, everything else is streamed out one
+        # top level statement at a time.
+        for statement in self.statements:
+            if isinstance(statement, ImportStatement):
+                statement.generate_c(top_level_writer, context)
+        top_level_writer.flush()
+
+        if self.lowered is None:
+            self.lower()
+        # Structs and signatures may use the string type before any
+        # literal does
+        if self.uses_strings():
+            top_level_writer.append_unique(cgen.CStatement(cgen.STRING_TYPEDEF))
+        for statement, lowered in zip(self.statements, self.lowered):
+            if isinstance(statement, ImportStatement) or header and isinstance(statement, Struct):
+                continue
+            if isinstance(lowered, ir.FunctionIR):
+                backend.generate_function(lowered, top_level_writer, context)
+            elif lowered is not None:
+                backend.CBackend(lowered, top_level_writer, context).emit()
+            else:
+                statement.generate_c(top_level_writer, context)
+            top_level_writer.flush()
+
+    def uses_strings(self) -> bool:
+        types = [member.type for statement in self.statements if isinstance(statement, Struct)
+                 for member in statement.member_list]
+        for lowered in self.lowered:
+            code = lowered or []
+            if isinstance(lowered, ir.FunctionIR):
+                types.append(lowered.return_type)
+                types.extend([t for _, t in lowered.params])
+                code = lowered.code
+            types.extend([instr.t for instr in code])
+        return any(isinstance(t, LocalStringType) for t in types)
+
+    def inline(self):
+        Inliner(self.functions, reserved=[statement.id for statement in self.statements
+                                          if isinstance(statement, (Function, Struct))]).run()
 
+    def lower(self):
+        # Bodies are lowered once; the optimizer and the C backend both
+        # work on the IR
+        self.lowered = []
         for statement in self.statements:
-            statement.generate_c(top_level_writer, context)
+            if isinstance(statement, Function):
+                self.lowered.append(statement.lower())
+            elif isinstance(statement, StatementBase):
+                builder = ir.Builder()
+                statement.lower(builder)
+                self.lowered.append(builder.code)
+            else:
+                self.lowered.append(None)
 
-        top_level.set_statement(top_level_writer.export())
+    def optimize(self):
+        if self.lowered is None:
+            self.lower()
+        for lowered in self.lowered:
+            if isinstance(lowered, ir.FunctionIR):
+                ir.optimize(lowered)
 
-        return top_level
+    def imports(self) -> list[str]:
+        return [statement.id for statement in self.statements
+                if isinstance(statement, ImportStatement)]
 
     def check_references(self, context):
         for function in self.functions:
@@ -1,15 +1,20 @@
 from abc import abstractmethod
 from src.context import ContextVar
-from src.error import throw_compiler_error
-from src.nodes.expressions import Expression, ExpressionBase
-from src.pitch_std import LibFunction
-from src.pitchtypes import FunctionType, IntType, LocalStringType, ReferenceType, TType, TypeBase, UnknownType, UnresolvedType,  resolve_with_scope
-from src.scope import Scope
+from src import ir
+from src.error import CompileError, span_of, throw_compiler_error
+from src.nodes.expressions import Expression, ExpressionBase, Group, Identifier, StructInit
+from src.pitch_std import Arena, LibFunction
+from src.pitchtypes import ArenaType, ErrorType, FunctionType, IntType, LocalStringType, ReferenceType, TType, TypeBase, UnknownType, UnresolvedType,  resolve_with_scope
+from src.scope import Scope, ScopeEntry
 import src.cgen as cgen
-from src.nodes.utils import printlog, Base
+from src.log import REFS, SCOPE
+from src.nodes.utils import printlog, Base, walk
 
 
 class StatementBase(Base):
+    # Source span, set by the parser
+    __slots__ = ("span",)
+
     @abstractmethod
     def populate_scope(self, scope, block):
         pass
@@ -19,38 +24,77 @@ class StatementBase(Base):
         pass
 
     @abstractmethod
-    def generate_c(self, writer: cgen.CWriter, context) -> str:
+    def lower(self, builder: ir.Builder):
         pass
 
 
+def pure(expression: ExpressionBase) -> bool:
+    # Calls are the only expressions with side effects
+    return not any(node.__class__.__name__ in ("Call", "CompCall")
+                   for node in walk(expression))
+
+
+def owning_arena(expression: ExpressionBase) -> ScopeEntry | None:
+    # The function's own arena an arena value or an arena allocated
+    # reference comes from, see ScopeEntry.arena
+    while isinstance(expression, Group):
+        expression = expression.expression
+    if isinstance(expression, Identifier):
+        return expression.entry.arena
+    if isinstance(expression, StructInit) and expression.arena:
+        return expression.arena_entry.arena
+    return None
+
+
 class ImportStatement(StatementBase):
+    __slots__ = ("id", "module", "lib")
+
     def __init__(self, id: str):
         self.id = id
+        self.module = None
+        self.lib = None
 
     def __repr__(self):
         return f'Import({self.id})'
 
     def populate_scope(self, scope: Scope, block):
-        printlog("Importing", self.id)
+        printlog("Importing", self.id, phase=SCOPE)
         scope.add(self.id, UnknownType())
 
     def to_c(self):
         return f'#include "{self.id}.h"'
 
     def check_references(self, context):
-        printlog("checking referencess...")
+        printlog("checking referencess...", phase=REFS)
+
+    def lower(self, builder: ir.Builder):
+        # Declarations only, nothing runs
+        pass
 
     def generate_c(self, writer: cgen.CWriter, context):
+        if self.module:
+            writer.add_import(self.module.header_name, local=True)
+            return
+        if self.lib:
+            # The library's runtime is emitted by its calls
+            return
         writer.add_import(f"p_{self.id}.h", local=True)
 
-    def resolve_imports(self, scope, libs: list[LibFunction]):
+    def resolve_imports(self, scope, libs: list[LibFunction], modules):
         for lib in libs:
             if lib.name == self.id:
-                scope.add(self.id, lib.t)
+                self.lib = lib
+                scope.add(self.id, lib.t, lib=lib)
                 return
 
+        if self.id in modules:
+            self.module = modules[self.id]
+            self.module.export(scope)
+
 
 class ExpressionStatement(StatementBase):
+    __slots__ = ("expression",)
+
     def __init__(self, expression: ExpressionBase):
         self.expression = expression
 
@@ -58,21 +102,22 @@ class ExpressionStatement(StatementBase):
         return f'ExprStmt(expr={self.expression})'
 
     def populate_scope(self, scope: Scope, block):
-        printlog("GOT EXPRESSION STATEMENT", self.expression)
+        printlog("GOT EXPRESSION STATEMENT", self.expression, phase=SCOPE)
         self.expression.compute_type(scope)
 
     def to_c(self):
         return f'{self.expression.to_c()};'
 
     def check_references(self, context):
-        printlog("checking referencess...")
+        printlog("checking referencess...", phase=REFS)
 
-    def generate_c(self, writer: cgen.CWriter, context):
-        writer.append(cgen.CStatement(
-            data=f'{self.expression.generate_c(writer, context)};'))
+    def lower(self, builder: ir.Builder):
+        builder.emit(ir.EVAL, args=(self.expression.lower(builder),))
 
 
 class StatementList(Base):
+    __slots__ = ("statements",)
+
     def __init__(self, statements: list[StatementBase]):
         self.statements = statements
 
@@ -94,23 +139,28 @@ class StatementList(Base):
 
     def populate_scope(self, scope, block):
         for statement in self.statements:
-            printlog("populating scope for", scope, block)
-            statement.populate_scope(scope, block)
+            printlog("populating scope for", scope, block, phase=SCOPE)
+            try:
+                statement.populate_scope(scope, block)
+            except CompileError as error:
+                scope.diagnostics.add(error, span_of(statement))
 
     def to_c(self, level=0):
         return "    "*level + f'\n{"    "*level}'.join([statement.to_c() for statement in self.statements])
 
     def check_references(self, context):
         for statement in self.statements:
-            printlog("ctx", context)
+            printlog("ctx", context, phase=REFS)
             statement.check_references(context)
-        printlog("ctx", context)
+        printlog("ctx", context, phase=REFS)
 
 
 class Return(StatementBase):
+    __slots__ = ("expression", "t")
 
     def __init__(self, expression: Expression):
         self.expression = expression
+        self.t: TypeBase = None
 
     def __repr__(self):
         return f'Return({repr(self.expression)}, {repr(self.expression.t)})'
@@ -118,58 +168,79 @@ class Return(StatementBase):
     def populate_scope(self, scope: Scope, block):
         block.returns = True
         expression_type = self.expression.compute_type(scope)
+        self.t = expression_type
         block.parent_function.return_types.append(expression_type)
 
         if isinstance(self.expression.t, ReferenceType) and self.expression.t.scope == "local":
             throw_compiler_error(
                 f'Cannot return reference type {self.expression.t}')
+        arena = owning_arena(self.expression)
+        if arena and isinstance(expression_type, (ReferenceType, ArenaType)):
+            # The arena is freed as the function returns
+            throw_compiler_error(
+                f'Cannot return {expression_type} from arena "{arena.name}" created in this function')
 
-    def generate_c(self, writer, context):
-        writer.append_statement(
-            f'return {self.expression.generate_c(writer, context, "return")};')
+    def lower(self, builder: ir.Builder):
+        value = self.expression.lower(builder)
+        # A return leaves every enclosing block
+        arenas = tuple(arena.name for frame in builder.arenas for arena in frame)
+        builder.emit(ir.RETURN, self.t, b=arenas, args=(value,))
 
     def check_references(self, context):
-        printlog("return issue")
+        printlog("return issue", phase=REFS)
 
 
 class Assignment(StatementBase):
+    __slots__ = ("id", "t", "expression", "entry")
 
     def __init__(self, id: str, expression: Expression, type=None):
         self.id = id
         self.t: TypeBase = type  # TODO rename var type
         self.expression = expression
+        self.entry: ScopeEntry = None
 
     def __repr__(self):
         return f'Assignment(id={self.id}, t={self.t}, {self.expression})'
 
     def populate_scope(self, scope: Scope, block):
+        try:
+            return self.check(scope)
+        except CompileError:
+            # Bound anyway, so the name's uses do not fail as undefined
+            scope.add(self.id, ErrorType())
+            raise
+
+    def check(self, scope: Scope):
         expression_type = self.expression.compute_type(scope)
         # check types.
         self.t = resolve_with_scope(self.t, scope)
 
         if isinstance(self.t, UnknownType):
-            printlog("inferred type for", self.id, "as", expression_type)
+            printlog("inferred type for", self.id, "as", expression_type, phase=SCOPE)
             self.t = expression_type
         elif not self.t.equal_to(expression_type):
             throw_compiler_error(
                 f'Identifier "{self.id}" type does not match expression type. Expected {self.t}, got {expression_type}')
         else:
-            printlog("type matches", self.t, expression_type)
+            printlog("type matches", self.t, expression_type, phase=SCOPE)
             self.t = expression_type
-        scope.add(self.id, expression_type)
+        self.entry = scope.add(self.id, expression_type)
+        if isinstance(self.expression, Call) and isinstance(self.expression.lib, Arena):
+            self.entry.arena = self.entry
+        else:
+            # Copies of an arena borrow it
+            self.entry.arena = owning_arena(self.expression)
         return expression_type
 
-    def generate_c(self, writer: cgen.CWriter, context):
-
-        printlog("Generating c for assignment",
-                 self.id, self.t, writer, context)
-
-        writer.append_statement(data=f'{self.t.to_c()} {self.id} = {
-            self.expression.generate_c(writer, context)};')
+    def lower(self, builder: ir.Builder):
+        builder.emit(ir.LET, self.t, self.id, self.entry, args=(self.expression.lower(builder),))
+        # Only the let creating an arena frees it
+        if self.entry.arena is self.entry and builder.arenas:
+            builder.arenas[-1].append(self.entry)
 
     def check_references(self, context):
         context.add(self.id, ContextVar(liveness=0, scope="local"))
-        printlog("checking referencess...")
+        printlog("checking referencess...", phase=REFS)
 
 
 """
@@ -209,6 +280,8 @@ class FieldAssignment(StatementBase):
 
 
 class Reassignment(StatementBase):
+    __slots__ = ("lexpr", "rexpr", "t")
+
     def __init__(self, lexpr: Expression, rexpr: Expression) -> None:
         self.lexpr = lexpr
         self.rexpr = rexpr
@@ -229,9 +302,9 @@ class Reassignment(StatementBase):
             throw_compiler_error(
                 f'Reassignment types do not match. You dummy tried to assign a {rexpr_type} to a {lexpr_type}')
 
-    def generate_c(self, writer: cgen.CWriter, context):
-        writer.append(cgen.CStatement(f'{self.lexpr.generate_c(writer, context)} = {
-                      self.rexpr.generate_c(writer, context)};'))
+    def lower(self, builder: ir.Builder):
+        target = self.lexpr.lower(builder)
+        builder.emit(ir.STORE, args=(target, self.rexpr.lower(builder)))
 
     def check_references(self, context):
         pass
@@ -268,6 +341,7 @@ class Reassignment(StatementBase):
 
 
 class ArgumentList():
+    __slots__ = ("expressions",)
 
     def __init__(self, expressions: list[Expression]):
         self.expressions = expressions
@@ -279,62 +353,62 @@ class ArgumentList():
         self.expressions.append(expression)
         return self
 
-    def generate_c(self, writer, context):
-        return ", ".join([expression.generate_c(writer, context) for expression in self.expressions])
+    def lower(self, builder: ir.Builder) -> tuple[int, ...]:
+        return tuple(expression.lower(builder) for expression in self.expressions)
 
 
 class Call(ExpressionBase):
+    __slots__ = ("id", "args", "lib", "arg_types")
 
     def __init__(self, id: str, args=None):
         self.id = id
         self.args: ArgumentList = args
         self.t: FunctionType = None
+        self.lib: LibFunction = None
+        self.arg_types = []
 
     def __repr__(self):
         return f'Call({repr(self.id)}, {repr(self.args)})'
 
     def compute_type(self, scope: Scope):
-        printlog("Computing call type")
+        printlog("Computing call type", phase=SCOPE)
+        scope_entry = scope.find(self.id)
+        params = None
+        if scope_entry and isinstance(scope_entry.type, FunctionType):
+            params = scope_entry.type.params
+
         arg_types = []
         if self.args:
             for i, arg in enumerate(self.args.expressions):
-                print("arg types during function call", arg.compute_type(scope))
                 arg_type = arg.compute_type(scope)
+                printlog("arg types during function call", arg_type, phase=SCOPE)
                 arg_types.append(arg_type)
-                scope_entry = scope.find(self.id)
-                if scope_entry and isinstance(scope_entry.type, FunctionType):
-                    if (scope_entry.type.params[i], TType):
-                        throw_compiler_error(
-                            f'Cannot call function with type T as argument')
+                if params and i < len(params) and isinstance(params[i], TType):
+                    throw_compiler_error(
+                        f'Cannot call function with type T as argument')
 
-        printlog("Call with arg types", arg_types)
+        printlog("Call with arg types", arg_types, phase=SCOPE)
         # Return type
         # Look for own type signature in scope
 
-        # if self.id == "alloc":
-        #    type_name = self.args.expressions[0].id
-        #    type_obj = resolve_with_scope(UnresolvedType(type_name), scope)
-        #    self.t = ReferenceType(type_obj, scope="heap")
-        #    printlog("Alloc type", self.t)
-        #    return self.t
-
-        if not scope.find(self.id):
+        if not scope_entry:
             throw_compiler_error(
                 f'Function "{self.id}" not found. Did you forget to declare it?')
 
-        self.t = scope.find(self.id).type
-        printlog("Call return type", self.t)
+        self.t = scope_entry.type
+        self.lib = scope_entry.lib
+        printlog("Call return type", self.t, phase=SCOPE)
 
+        if self.lib:
+            self.arg_types = arg_types
+            return self.lib.compute_type(arg_types)
         return self.t.return_type
 
-    def generate_c(self, writer, context):
-        # if self.id == "alloc":
-        #    return f'malloc((size_t) {self.args.expressions[1].generate_c(writer, context)} * sizeof({self.t.to.to_c()}))'
-        if self.args:
-            printlog("function has args, passing those")
-            return f'{self.id}({self.args.generate_c(writer, context)})'
-        else:
-            return f'{self.id}(void)'
+    def lower(self, builder: ir.Builder):
+        args = self.args.lower(builder) if self.args else ()
+        if self.lib:
+            return builder.emit(ir.LIB, self.lib.compute_type(self.arg_types), self.lib, self.arg_types, args)
+        return builder.emit(ir.CALL, self.t.return_type, self.id, self.t, args)
 
     def evaluates_to(self):
         return "value"
@@ -1,13 +1,61 @@
-import logging
 from abc import ABC
 
-
-def printlog(*args):
-    logging.info(" ".join([str(arg) for arg in args]))
+from src.log import printlog
 
 
 class Base(ABC):
+    __slots__ = ()
+
     pass
 
     def __format__(self, format_spec):
         return self.__repr__()
+
+
+_node_fields: dict[type, tuple[str, ...] | None] = {}
+
+
+def fields(cls: type) -> tuple[str, ...] | None:
+    # Attribute names of an AST node class that may hold children, None
+    # for anything that is not a node. Attributes named parent* point back
+    # up the tree and are left out.
+    try:
+        return _node_fields[cls]
+    except KeyError:
+        pass
+    names = None
+    if cls.__module__.startswith("src.nodes."):
+        names = tuple(name for klass in reversed(cls.__mro__)
+                      for name in getattr(klass, "__slots__", ())
+                      if not name.startswith("parent"))
+    _node_fields[cls] = names
+    return names
+
+
+def children(node):
+    # (name, value) of the set fields of node
+    for name in fields(type(node)):
+        value = getattr(node, name, None)
+        if value is not None:
+            yield name, value
+
+
+def walk(root):
+    # Yields every AST node below root, root first
+    seen = set()
+    stack = [root]
+    while stack:
+        value = stack.pop()
+        cls = type(value)
+        if cls is list or cls is tuple:
+            stack.extend(value)
+            continue
+        names = fields(cls)
+        if names is None or id(value) in seen:
+            continue
+        seen.add(id(value))
+        yield value
+        for name in names:
+            child = getattr(value, name, None)
+            if child is not None:
+                stack.append(child)
@@ -2,10 +2,15 @@
 
 from abc import ABC
 
-from src.pitchtypes import AnyType, FunctionType, IntType, ReferenceType, TType
+from src import cgen
+from src.error import throw_compiler_error
+from src.pitchtypes import AnyType, ArenaType, FunctionType, IntType, ReferenceType, StructType, TType
 
 
 class LibFunction(ABC):
+    # Runtime header (src/runtime/<name>.h) the generated code depends on
+    runtime = None
+
     def __init__(self, name, t):
         self.name = name
         self.t = t
@@ -20,12 +25,50 @@ class LibFunction(ABC):
     def to_c(self, args):
         pass
 
+    def compute_type(self, arg_types: list):
+        # Type of a call with the given argument types
+        return self.t.return_type
+
+    def generate_c(self, args: list[str], arg_types: list, writer: cgen.CWriter, context):
+        if self.runtime:
+            writer.append_tls(cgen.CStatement(cgen.runtime(self.runtime)))
+        return self.to_c(args)
+
 
 class Alloc(LibFunction):
+    runtime = "alloc"
+
     def __init__(self):
         super().__init__("alloc", FunctionType(
             ReferenceType(TType("T")), [ReferenceType(TType("T")), IntType(32)]))
 
+    def compute_type(self, arg_types):
+        if len(arg_types) != 2 or not isinstance(arg_types[0], StructType):
+            throw_compiler_error("alloc expects a struct and a count, alloc(T, n)")
+        if not isinstance(arg_types[1], IntType):
+            throw_compiler_error(
+                f'alloc count must be an integer, got {arg_types[1]}')
+        return ReferenceType(arg_types[0], scope="heap")
+
+    def generate_c(self, args, arg_types, writer, context):
+        super().generate_c(args, arg_types, writer, context)
+        struct_c = arg_types[0].to_c()
+        size = f"sizeof({struct_c})"
+        if args[1] != "1":
+            size = f"{size} * (size_t)({args[1]})"
+        return f"({struct_c}*)_pt_alloc({size})"
+
+
+class Arena(LibFunction):
+    runtime = "arena"
+
+    def __init__(self):
+        super().__init__("Arena", FunctionType(ArenaType(), []))
+
     @classmethod
     def to_c(self, args):
-        return f"alloc({args[0]})"
+        return "_pt_arena_new()"
+
+
+# Always in scope, no import needed
+BUILTINS = [Arena()]
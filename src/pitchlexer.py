@@ -1,5 +1,10 @@
+import sys
+
 import ply.lex as lex
 
+from src.cache import cache_dir, fingerprint, load_table
+from src.error import Diagnostics, print_error
+from src.log import LEX, PlyLogger
 from src.nodes.utils import printlog
 
 
@@ -107,6 +112,9 @@ class PitchLexer(object):
 
         if t.value in self.reserved:
             t.type = self.reserved[t.value]
+        else:
+            # Names repeat all over a program, every node shares one string
+            t.value = sys.intern(t.value)
         return t
 
     # Define a rule so we can track line numbers
@@ -120,11 +128,34 @@ class PitchLexer(object):
 
     # Error handling rule
     def t_error(self, t):
-        printlog(f"Illegal character '{t.value[0]}'")
+        if self.diagnostics is None:
+            print_error(f"Illegal character '{t.value[0]}' at line {
+                        t.lexer.lineno}")
+        else:
+            self.diagnostics.error(f"Illegal character {t.value[0]!r}",
+                                   self.lexed.span(t.lexpos, t.lexpos + 1))
         t.lexer.skip(1)
 
+    @classmethod
+    def fingerprint(cls):
+        rules = [(name, rule.__doc__ if callable(rule) else rule)
+                 for name, rule in vars(cls).items() if name.startswith("t_")]
+        return fingerprint(lex.__version__, cls.tokens, rules)
+
     def __init__(self, **kwargs):
-        self.lexer = lex.lex(module=self, **kwargs)
+        # Tables are keyed by the token rules, so a matching lextab is loaded
+        # as is and the rules are neither re-validated nor recompiled.
+        table_dir = cache_dir("tables")
+        table_name = f"lextab_{self.fingerprint()}"
+        lextab = load_table(table_dir, table_name) or table_name
+        # Where illegal characters go while PitchParser lexes a source,
+        # with the src.tokenizer.Tokens holding its line starts; printed
+        # otherwise
+        self.diagnostics: Diagnostics = None
+        self.lexed = None
+        self.lexer = lex.lex(module=self, optimize=True, lextab=lextab,
+                             outputdir=table_dir, errorlog=PlyLogger(LEX),
+                             **kwargs)
 
     # Test it output
     def test(self, data):
@@ -133,4 +164,4 @@ class PitchLexer(object):
             tok = self.lexer.token()
             if not tok:
                 break
-            printlog(tok)
+            printlog(tok, phase=LEX)
@@ -1,7 +1,11 @@
 import ply.yacc as yacc
 import src.nodes as nodes
+from src.cache import cache_dir, fingerprint, load_table
+from src.error import Diagnostics, Span
+from src.log import PARSE, PlyLogger
 from src.nodes.utils import printlog
 from src.pitchlexer import PitchLexer
+from src.tokenizer import Tokens, TokenStream, tokenize
 from src.pitchtypes import MaybeType, ReferenceType, TypeBase, UnknownType, UnresolvedType
 from src.scope import Scope
 
@@ -15,10 +19,13 @@ class PitchParser(object):
         program : top_level_statement
                 | program top_level_statement
         '''
+        # Statements dropped by error recovery are None
         if len(t) == 2:
-            t[0] = nodes.Program([t[1]])
-        else:
+            t[0] = nodes.Program([t[1]] if t[1] else [])
+        elif t[2]:
             t[0] = t[1].append(t[2])
+        else:
+            t[0] = t[1]
 
     def p_top_level_def(self, t):
         '''
@@ -40,12 +47,14 @@ class PitchParser(object):
         else:
             t[0] = nodes.Function(id=t[2], params=t[4],
                                   return_type=t[6], block=t[7])
+        t[0].span = self.span(t, 1, len(t) - 3)
 
     def p_import_statement(self, t):
         '''
         import_statement : IMPORT ID SEMI
         '''
         t[0] = nodes.ImportStatement(id=t[2])
+        t[0].span = self.span(t, 1, 3)
 
     def p_struct_member(self, t):
         '''
@@ -68,8 +77,9 @@ class PitchParser(object):
         '''
         struct : STRUCT ID LBRACE struct_members RBRACE
         '''
-        printlog("struct", t[4])
+        printlog("struct", t[4], phase=PARSE)
         t[0] = nodes.Struct(id=t[2], members=t[4])
+        t[0].span = self.span(t, 1, 5)
 
     def p_block(self, t):
         '''
@@ -77,15 +87,34 @@ class PitchParser(object):
         '''
         t[0] = nodes.Block(t[2])
 
+    def p_block_error(self, t):
+        '''
+        block : LBRACE error RBRACE
+              | LBRACE statement_list error RBRACE
+        '''
+        # Panic mode: the rest of the block is dropped
+        t.parser.errok()
+        t[0] = nodes.Block(t[2] if len(t) == 5 else nodes.StatementList([]))
+
     def p_statement_list(self, t):
         '''
         statement_list : statement
                        | statement_list statement
         '''
         if len(t) == 2:
-            t[0] = nodes.StatementList([t[1]])
-        else:
+            t[0] = nodes.StatementList([t[1]] if t[1] else [])
+        elif t[2]:
             t[0] = t[1].append(t[2])
+        else:
+            t[0] = t[1]
+
+    def p_statement_error(self, t):
+        '''
+        statement : error SEMI
+        '''
+        # Panic mode: the statement is dropped up to its `;`
+        t.parser.errok()
+        t[0] = None
 
     def p_expression_binop(self, t):
         '''
@@ -142,36 +171,42 @@ class PitchParser(object):
         statement : RETURN expression SEMI
         '''
         t[0] = nodes.Return(t[2])
+        t[0].span = self.span(t, 1, 3)
 
     def p_assignment(self, t):
         '''
         statement : LET ID EQUALS expression SEMI
         '''
         t[0] = nodes.Assignment(id=t[2], expression=t[4], type=UnknownType())
+        t[0].span = self.span(t, 1, 5)
 
     def p_typed_assignment(self, t):
         '''
         statement : LET ID COLON type EQUALS expression SEMI
         '''
         t[0] = nodes.Assignment(id=t[2], expression=t[6], type=t[4])
+        t[0].span = self.span(t, 1, 7)
 
     def p_reassignment(self, t):
         '''
         statement : expression EQUALS expression SEMI
         '''
         t[0] = nodes.Reassignment(lexpr=t[1], rexpr=t[3])
+        t[0].span = self.span(t, 2, 4)
 
     def p_if(self, t):
         '''
         statement : IF LPAREN expression RPAREN block
         '''
         t[0] = nodes.If(t[3], t[5])
+        t[0].span = self.span(t, 1, 4)
 
     def p_call_statement(self, t):
         '''
         statement : expression SEMI
         '''
         t[0] = nodes.ExpressionStatement(t[1])
+        t[0].span = self.span(t, 2, 2)
 
     def p_call(self, t):
         '''
@@ -200,8 +235,17 @@ class PitchParser(object):
         t[0] = nodes.CompCall(id=t[2], arguments=t[4])
 
     def p_error(self, t):
-        printlog(f"Syntax error")
-        printlog(t.type, t.value, t.lineno, t.lexpos)
+        if not t:
+            end = len(self.lexed.source)
+            self.diagnostics.error("Syntax error: unexpected end of input", self.lexed.span(end, end))
+            return
+        self.diagnostics.error(f"Syntax error: unexpected {t.type} {t.value!r}",
+                               self.lexed.span(t.lexpos, t.lexpos + len(str(t.value))))
+
+    def span(self, t, first: int, last: int) -> Span:
+        # From terminal first to terminal last of a production, without
+        # position tracking PLY knows no positions of nonterminals
+        return self.lexed.span(t.lexpos(first), t.lexpos(last) + len(t[last]))
 
     def p_string(self, t):
         '''
@@ -285,7 +329,7 @@ class PitchParser(object):
         if len(t) == 2:
             t[0] = [t[1]]
         else:
-            printlog(t[0], t[1], t[3])
+            printlog(t[0], t[1], t[3], phase=PARSE)
             t[0] = t[1] + [t[3]]
 
     def p_struct_init(self, t):
@@ -294,6 +338,13 @@ class PitchParser(object):
         '''
         t[0] = nodes.StructInit(id=t[1], members=t[3], alloc=False)
 
+    def p_arena_struct_init(self, t):
+        '''
+        expression : ID COLON ID LBRACE struct_init_members RBRACE
+        '''
+        t[0] = nodes.StructInit(
+            id=t[1], members=t[5], alloc=True, arena=t[3])
+
     start = 'program'
 
     precedence = (
@@ -304,14 +355,56 @@ class PitchParser(object):
         ('nonassoc', 'TIMES'),
         ('nonassoc', 'REF'),
         ('nonassoc', 'AMPERSAND'),
-
-
-
+        ('left', 'FIELD_DEREFERENCE'),
     )
 
-    def __init__(self, outputdir="generated"):
-        self.lexer = PitchLexer()
-        self.parser = yacc.yacc(module=self, outputdir=outputdir)
-
-    def parse(self, data):
-        return self.parser.parse(data, debug=False)
+    @classmethod
+    def fingerprint(cls):
+        rules = [(name, rule.__doc__)
+                 for name, rule in vars(cls).items() if name.startswith("p_")]
+        return fingerprint(yacc.__version__, cls.start, cls.precedence,
+                           cls.tokens, rules)
+
+    def __init__(self, ply_lexer=False):
+        # Sources are lexed by src.tokenizer unless PLY's lexer is asked for
+        self.lexer = PitchLexer() if ply_lexer else None
+        # Token array of the source being parsed, for positions; `tokens`
+        # is the token list of the grammar
+        self.lexed: Tokens = None
+        self.diagnostics: Diagnostics = None
+
+        # A parsetab matching the grammar fingerprint is bound directly
+        # (optimize skips PLY's signature check and grammar validation),
+        # otherwise the LALR tables are generated once and written there.
+        table_dir = cache_dir("tables")
+        table_name = f"parsetab_{self.fingerprint()}"
+        parsetab = load_table(table_dir, table_name)
+        self.parser = yacc.yacc(module=self, debug=False,
+                                optimize=parsetab is not None,
+                                tabmodule=parsetab or table_name,
+                                outputdir=table_dir,
+                                write_tables=table_dir is not None,
+                                errorlog=PlyLogger(PARSE))
+
+    def parse(self, data, diagnostics: Diagnostics = None) -> nodes.Program:
+        # data is source text or the UTF-8 buffer of a src.source.Source.
+        # Raises CompileErrors with every syntax error. A broken statement
+        # is skipped up to its `;` or `}` and parsing goes on.
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        try:
+            if self.lexer:
+                if not isinstance(data, str):
+                    data = bytes(data).decode()
+                self.lexed = Tokens.lines_of(data)
+                self.lexer.lexed, self.lexer.diagnostics = self.lexed, self.diagnostics
+                self.lexer.lexer.lineno = 1
+                program = self.parser.parse(data, lexer=self.lexer.lexer, debug=False)
+            else:
+                self.lexed = tokenize(data, self.diagnostics)
+                program = self.parser.parse(lexer=TokenStream(self.lexed), debug=False)
+        finally:
+            self.lexed = None
+            if self.lexer:
+                self.lexer.lexed, self.lexer.diagnostics = None, None
+        self.diagnostics.check()
+        return program
@@ -1,36 +1,85 @@
+import weakref
 from abc import ABC, ABCMeta, abstractmethod
 
 from src import cgen
 from src.context import Context
 from src.error import throw_compiler_error
-from src.nodes.utils import printlog
+from src.log import SCOPE, printlog
 
 
 def resolve_with_scope(type_from_scope, scope):
-    if isinstance(type_from_scope, UnresolvedType):
+    # Named types resolve against the module, see TypeResolver
+    return scope.types.resolve(type_from_scope)
 
-        type_from_scope = scope.find(type_from_scope.name)
-        print("type from scope", type_from_scope)
-        if not type_from_scope:
-            throw_compiler_error(f'Could not resolve type {
-                                 type_from_scope.name}. Did you forget to declare it?')
-        type_from_scope = type_from_scope.type
 
-    if isinstance(type_from_scope, ReferenceType):
-        type_from_scope.to = resolve_with_scope(type_from_scope.to, scope)
+class InternedType():
+    # Types are immutable and hash-consed: constructing a type equal to an
+    # existing one returns that object. Equality is identity, hashing is
+    # by id and comparing or building a known type allocates nothing.
+    # Subclasses list their fields in __slots__ and construct through
+    # intern() from __new__.
+    __slots__ = ("__weakref__",)
+    # Instances of the class by field values, one table per class. The
+    # tables hold types weakly: a type lives as long as some tree or
+    # builtin uses it, so a long running process compiling many programs
+    # does not keep every type it ever saw.
+    _interned: weakref.WeakValueDictionary = weakref.WeakValueDictionary()
 
-    print("resolved type", type_from_scope)
-    return type_from_scope
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._interned = weakref.WeakValueDictionary()
 
+    @classmethod
+    def intern(cls, *values):
+        t = cls._interned.get(values)
+        if t is None:
+            t = cls._interned[values] = cls._create(values)
+        return t
+
+    @classmethod
+    def _create(cls, values):
+        t = object.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            object.__setattr__(t, name, value)
+        return t
+
+    def __new__(cls):
+        return cls.intern()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __reduce__(self):
+        # Unpickling interns again, so types stay unique across processes
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class UnknownType(InternedType):
+    __slots__ = ()
 
-class UnknownType(object):
     def __repr__(self):
         return "T(Unknown)"
 
 
-class TType(object):
-    def __init__(self, t) -> None:
-        self.t = t
+class ErrorType(InternedType):
+    # Of a name whose let failed to check, see ReportedError
+    __slots__ = ()
+
+    def __repr__(self):
+        return "T(Error)"
+
+
+class TType(InternedType):
+    __slots__ = ("t",)
+
+    def __new__(cls, t):
+        return cls.intern(t)
 
     def __repr__(self):
         return "T(T)"
@@ -43,7 +92,9 @@ class TType(object):
         return self.t == other.t
 
 
-class AnyType(object):
+class AnyType(InternedType):
+    __slots__ = ()
+
     def __repr__(self):
         return "T(Any)"
 
@@ -54,11 +105,13 @@ class AnyType(object):
         return "void"
 
 
-class ReferenceType(object):
-    def __init__(self, to, is_mutable=False, scope="local"):
-        self.to = to
-        self.is_mutable = is_mutable
-        self.scope = scope
+class ReferenceType(InternedType):
+    # scope tells where the target lives (local, arena, heap, global);
+    # references to the same type are compatible whatever their scope
+    __slots__ = ("to", "is_mutable", "scope")
+
+    def __new__(cls, to, is_mutable=False, scope="local"):
+        return cls.intern(to, is_mutable, scope)
 
     def __repr__(self):
         return f"RefT({self.to})"
@@ -71,18 +124,22 @@ class ReferenceType(object):
             return False
         if not self.to or not other.to:
             raise Exception("Hey stupid, you have a reference to nothing")
-        return type(other) == ReferenceType and self.to.equal_to(other.to)
+        return self.to is other.to
+
 
+class MaybeType(InternedType):
+    __slots__ = ("ok_type",)
 
-class MaybeType(object):
-    def __init__(self, ok_type):
-        self.ok_type = ok_type
+    def __new__(cls, ok_type):
+        return cls.intern(ok_type)
 
     def __repr__(self):
         return f"T(Maybe({self.ok_type}))"
 
 
-class TypeBase(ABC):
+class TypeBase(InternedType, ABC):
+    __slots__ = ()
+
     @abstractmethod
     def to_c(self):
         pass
@@ -93,16 +150,20 @@ class TypeBase(ABC):
 
 
 class UnresolvedType(TypeBase):
-    def __init__(self, name: str):
-        self.name = name
+    __slots__ = ("name",)
+
+    def __new__(cls, name: str):
+        return cls.intern(name)
 
     def resolve(self):
         if self.name == "i32":
             return IntType(32)
         if self.name == "str":
-            return LocalStringType(None)
+            return LocalStringType()
+        if self.name == "Arena":
+            return ArenaType()
         else:
-            return UnresolvedType(self.name)
+            return self
 
     def __repr__(self):
         return f"T_unres({self.name})"
@@ -114,9 +175,11 @@ class UnresolvedType(TypeBase):
         raise Exception("Cannot compare unresolved type")
 
 
-class IntType(object):
-    def __init__(self, size):
-        self.size = size
+class IntType(InternedType):
+    __slots__ = ("size",)
+
+    def __new__(cls, size):
+        return cls.intern(size)
 
     def __repr__(self):
         return f"T(i{self.size})"
@@ -134,57 +197,56 @@ class IntType(object):
             raise Exception("Invalid int size")
 
     def equal_to(self, other):
-        return type(other) == IntType and self.size == other.size
+        return other is self
 
 
 class LocalStringType(TypeBase):
-    def __init__(self, size):
-        self.size = size
+    # The length is a property of each string, not of the type
+    __slots__ = ()
 
     def __repr__(self):
-        return f"T_str({self.size}))"
+        return "T_str"
 
     def to_c(self):
         return f"_pt_str"
 
     def equal_to(self, other):
-        return type(other) == LocalStringType
+        return other is self
 
 
-class FunctionType(object):
-    def __init__(self, return_type: TypeBase, params: list[TypeBase]):
-        self.return_type = return_type
-        self.params = params
+class FunctionType(InternedType):
+    __slots__ = ("return_type", "params")
+
+    def __new__(cls, return_type: TypeBase, params: list[TypeBase]):
+        return cls.intern(return_type, tuple(params))
 
     def __repr__(self):
-        print("params are", self.params)
         return f"({",".join([param.__repr__() for param in self.params])}) -> {self.return_type}"
 
     def equal_to(self, other):
-        if type(other) != FunctionType:
-            return False
-        if not self.return_type.equal_to(other.return_type):
-            return False
-        if len(self.params) != len(other.params):
-            return False
-        for i in range(len(self.params)):
-            if not self.params[i].equal_to(other.params[i]):
-                return False
-        return True
+        return other is self
 
 
 def parse_type(_type: str):
-    print("parsing type ", _type, type(_type))
+    printlog("parsing type ", _type, type(_type), phase=SCOPE)
     if _type == "i32":
         return IntType(32)
     else:
         raise Exception(f"Invalid type {_type}")
 
 
-class StructType(object):
-    def __init__(self, name, fields: dict[str, TypeBase]):
-        self.name = name
-        self.fields = fields
+class StructType(InternedType):
+    # Structs with the same name and members are the same type
+    __slots__ = ("name", "fields")
+
+    def __new__(cls, name, fields: dict[str, TypeBase]):
+        # Keyed by the members in order, the fields dict itself is not
+        # hashable
+        key = (name, tuple(fields.items()))
+        t = cls._interned.get(key)
+        if t is None:
+            t = cls._interned[key] = cls._create((name, dict(fields)))
+        return t
 
     def __repr__(self):
         return f"Struct({self.name}, {self.fields})"
@@ -193,20 +255,25 @@ class StructType(object):
         return f"struct {self.name} {{\n{self.fields}\n}}"
 
     def equal_to(self, other):
-        # return type(other) == StructTypes and self.name == other.name
-        return True
+        return other is self
 
     def has_member(self, member_name):
         return member_name in self.fields
 
     def get_member(self, member_name):
-        return self.fields[member_name]
+        member = self.fields[member_name]
+        if isinstance(member, ReferenceType) and member.to is ShallowStructType(self.name):
+            # Points back at this struct
+            return ReferenceType(self, member.is_mutable, member.scope)
+        return member
 
     def to_c(self):
         return f"struct {self.name}"
 
 
-class VoidType(object):
+class VoidType(InternedType):
+    __slots__ = ()
+
     def __repr__(self):
         return "T(void)"
 
@@ -214,12 +281,14 @@ class VoidType(object):
         return "void"
 
     def equal_to(self, other):
-        return type(other) == VoidType
+        return other is self
 
 
-class ShallowStructType(object):
-    def __init__(self, name):
-        self.name = name
+class ShallowStructType(InternedType):
+    __slots__ = ("name",)
+
+    def __new__(cls, name):
+        return cls.intern(name)
 
     def __repr__(self):
         return f"ShallowStruct({self.name})"
@@ -228,4 +297,63 @@ class ShallowStructType(object):
         return f"struct {self.name}"
 
     def equal_to(self, other):
-        return type(other) == ShallowStructType and self.name == other.name
+        return other is self
+
+
+class ArenaType(InternedType):
+    __slots__ = ()
+
+    def __repr__(self):
+        return "T(Arena)"
+
+    def to_c(self):
+        return "_pt_arena*"
+
+    def equal_to(self, other):
+        return other is self
+
+
+class TypeResolver():
+    # Resolves the named types (structs) in type annotations. Names are
+    # looked up in the module scope once, every later annotation with the
+    # same type is a cache hit; types are interned, so the unresolved type
+    # itself is the key. One resolver is shared by all scopes of a module.
+    def __init__(self, scope):
+        self.scope = scope
+        self.resolved: dict = {}
+        # Structs whose members are being resolved. A reference to one of
+        # them is a ShallowStructType, the struct type does not exist yet.
+        self.declaring: set[str] = set()
+        self._shallow = False
+
+    def resolve(self, t):
+        if not isinstance(t, (UnresolvedType, ReferenceType)):
+            return t
+        resolved = self.resolved.get(t)
+        if resolved is None:
+            self._shallow = False
+            resolved = self._resolve(t, False)
+            printlog("resolved type", t, "to", resolved, phase=SCOPE)
+            # Forward references only hold inside their declaration
+            if not self._shallow:
+                self.resolved[t] = resolved
+        return resolved
+
+    def _resolve(self, t, referenced: bool):
+        if isinstance(t, ReferenceType):
+            return ReferenceType(self._resolve(t.to, True), t.is_mutable, t.scope)
+        if not isinstance(t, UnresolvedType):
+            return t
+        if t.name in self.declaring:
+            if not referenced:
+                throw_compiler_error(
+                    f'Struct "{t.name}" cannot contain itself, use a reference')
+            self._shallow = True
+            return ShallowStructType(t.name)
+        entry = self.scope.find(t.name)
+        if not entry:
+            throw_compiler_error(
+                f'Could not resolve type {t.name}. Did you forget to declare it?')
+        if not isinstance(entry.type, StructType):
+            throw_compiler_error(f'"{t.name}" is not a type')
+        return entry.type
@@ -0,0 +1,374 @@
+import src.nodes as nodes
+from src.error import Diagnostics
+from src.log import PARSE
+from src.nodes.utils import printlog
+from src.pitchtypes import MaybeType, ReferenceType, UnknownType, UnresolvedType
+from src.tokenizer import Tokens, tokenize
+
+# Binding power of the infix operators, as in PitchParser.precedence
+BINARY = {
+    "DOUBLE_EQUALS": 10,
+    "PLUS": 20,
+    "MINUS": 20,
+    "TIMES": 30,
+    "DIVIDE": 30,
+}
+# Operands of & and * bind tighter than any infix operator, `->` tighter
+# still: `*a + b` is `(*a) + b` and `*a->b` is `*(a->b)`
+PREFIX = 40
+
+END = "$end"
+
+
+class ParseError(Exception):
+    def __init__(self, index: int):
+        # Index of the unexpected token
+        self.index = index
+
+
+class PrattParser():
+    # Hand written parser for the grammar of PitchParser, building the same
+    # nodes: recursive descent for statements and precedence climbing for
+    # expressions. It reads the token array by index instead of pulling
+    # token objects, collects lists in place and wraps each one once, and
+    # loops over statement lists and operator chains instead of recursing.
+    def __init__(self):
+        self.tokens: Tokens = None
+        self.types: list[str] = []
+        self.values: list = []
+        self.index = 0
+        self.diagnostics: Diagnostics = None
+
+    def parse(self, data, diagnostics: Diagnostics = None) -> nodes.Program:
+        # Raises CompileErrors with every syntax error. A broken statement
+        # is skipped up to its `;` or `}` and parsing goes on.
+        self.diagnostics = diagnostics if diagnostics is not None else Diagnostics()
+        self.tokens = tokenize(data, self.diagnostics)
+        lexed = len(self.diagnostics)
+        # End marker, so looking one token ahead never runs off the end
+        self.types = self.tokens.types + [END]
+        self.values = self.tokens.values
+        self.index = 0
+        program = None
+        try:
+            statements = []
+            while self.types[self.index] != END:
+                statement = self.recover(self.top_level_statement)
+                if statement:
+                    statements.append(statement)
+                elif self.types[self.index] == "RBRACE":
+                    # Closes nothing at the top level
+                    self.index += 1
+            if not statements and len(self.diagnostics) == lexed:
+                # Empty input, rather than every statement dropped by recovery
+                raise ParseError(self.index)
+            program = nodes.Program(statements)
+        except ParseError as error:
+            # Only running out of input ends the parse
+            self.error(error.index)
+        except RecursionError:
+            # Expressions nest without recursion, blocks still recurse
+            index = min(self.index, len(self.tokens) - 1)
+            self.diagnostics.error("Blocks nested too deeply", self.tokens.token_span(index, index))
+        finally:
+            self.tokens, self.types, self.values = None, [], []
+        self.diagnostics.check()
+        return program
+
+    def error(self, index: int):
+        kind = self.types[index]
+        if kind == END:
+            end = len(self.tokens.source)
+            self.diagnostics.error("Syntax error: unexpected end of input", self.tokens.span(end, end))
+            return
+        self.diagnostics.error(f"Syntax error: unexpected {kind} {self.values[index]!r}",
+                               self.tokens.token_span(index, index))
+
+    def recover(self, parse):
+        # Parses one statement, giving it its span. On a syntax error the
+        # error is recorded and the statement skipped, None is returned.
+        first = self.index
+        try:
+            statement = parse()
+        except ParseError as error:
+            if self.types[error.index] == END:
+                raise
+            self.error(error.index)
+            self.synchronize(first, error.index)
+            return None
+        statement.span = self.tokens.token_span(first, self.index - 1)
+        return statement
+
+    def synchronize(self, first: int, index: int):
+        # Skips the rest of the statement started at first: up to and
+        # including its `;` or the `}` closing a brace it opened, or up to
+        # the `}` closing the enclosing block
+        types = self.types
+        depth = types[first:index].count("LBRACE") - types[first:index].count("RBRACE")
+        while True:
+            kind = types[index]
+            if kind == END:
+                break
+            if kind == "SEMI" and depth <= 0:
+                index += 1
+                break
+            if kind == "LBRACE":
+                depth += 1
+            elif kind == "RBRACE":
+                if depth <= 0:
+                    break
+                depth -= 1
+                if depth == 0:
+                    index += 1
+                    if types[index] == "SEMI":
+                        index += 1
+                    break
+            index += 1
+        self.index = index
+
+    def expect(self, kind: str):
+        index = self.index
+        if self.types[index] != kind:
+            raise ParseError(index)
+        self.index = index + 1
+        return self.values[index]
+
+    def accept(self, kind: str) -> bool:
+        if self.types[self.index] != kind:
+            return False
+        self.index += 1
+        return True
+
+    def top_level_statement(self):
+        kind = self.types[self.index]
+        if kind == "FN":
+            return self.function()
+        if kind == "STRUCT":
+            return self.struct()
+        if kind == "IMPORT":
+            self.index += 1
+            id = self.expect("ID")
+            self.expect("SEMI")
+            return nodes.ImportStatement(id=id)
+        return self.statement()
+
+    def function(self) -> nodes.Function:
+        self.index += 1
+        id = self.expect("ID")
+        self.expect("LPAREN")
+        params = None
+        if not self.accept("RPAREN"):
+            parameters = [self.parameter()]
+            while self.accept("COMMA"):
+                parameters.append(self.parameter())
+            self.expect("RPAREN")
+            params = nodes.ParameterList(parameters)
+        return_type = self.type()
+        return nodes.Function(id=id, params=params, return_type=return_type, block=self.block())
+
+    def parameter(self) -> nodes.Parameter:
+        id = self.expect("ID")
+        self.expect("COLON")
+        return nodes.Parameter(id=id, type=self.type())
+
+    def struct(self) -> nodes.Struct:
+        self.index += 1
+        id = self.expect("ID")
+        self.expect("LBRACE")
+        members = [self.struct_member()]
+        while not self.accept("RBRACE"):
+            members.append(self.struct_member())
+        printlog("struct", members, phase=PARSE)
+        return nodes.Struct(id=id, members=members)
+
+    def struct_member(self) -> nodes.StructMember:
+        id = self.expect("ID")
+        self.expect("COLON")
+        t = self.type()
+        self.expect("SEMI")
+        return nodes.StructMember(id=id, type=t)
+
+    def type(self):
+        # `&T?` is a maybe of a reference
+        t = self.reference_type()
+        while self.accept("QUESTIONMARK"):
+            t = MaybeType(ok_type=t)
+        return t
+
+    def reference_type(self):
+        kind = self.types[self.index]
+        if kind == "REF" or kind == "AMPERSAND":
+            self.index += 1
+            return ReferenceType(self.reference_type())
+        return UnresolvedType(self.expect("ID")).resolve()
+
+    def block(self) -> nodes.Block:
+        self.expect("LBRACE")
+        if self.types[self.index] == "RBRACE":
+            # A block holds at least one statement
+            raise ParseError(self.index)
+        statements = []
+        while not self.accept("RBRACE"):
+            statement = self.recover(self.statement)
+            if statement:
+                statements.append(statement)
+        return nodes.Block(nodes.StatementList(statements))
+
+    def statement(self):
+        kind = self.types[self.index]
+        if kind == "RETURN":
+            self.index += 1
+            expression = self.expression()
+            self.expect("SEMI")
+            return nodes.Return(expression)
+        if kind == "LET":
+            self.index += 1
+            id = self.expect("ID")
+            t = self.type() if self.accept("COLON") else UnknownType()
+            self.expect("EQUALS")
+            expression = self.expression()
+            self.expect("SEMI")
+            return nodes.Assignment(id=id, expression=expression, type=t)
+        if kind == "IF":
+            self.index += 1
+            self.expect("LPAREN")
+            condition = self.expression()
+            self.expect("RPAREN")
+            return nodes.If(condition, self.block())
+
+        expression = self.expression()
+        if self.accept("EQUALS"):
+            value = self.expression()
+            self.expect("SEMI")
+            return nodes.Reassignment(lexpr=expression, rexpr=value)
+        self.expect("SEMI")
+        return nodes.ExpressionStatement(expression)
+
+    def expression(self, power: int = 0):
+        # Precedence climbing without recursion: constructs still waiting
+        # for an operand (groups, prefix operators, the left side of an
+        # infix operator, argument and member lists) are frames on an
+        # explicit stack, so nesting is not bounded by Python's
+        # recursion limit. A frame is [kind, power to restore, data].
+        types = self.types
+        values = self.values
+        stack = []
+        while True:
+            # Open constructs up to the first plain operand
+            while True:
+                index = self.index
+                kind = types[index]
+                if kind == "LPAREN":
+                    self.index = index + 1
+                    stack.append(["group", power, None])
+                    power = 0
+                elif kind == "AMPERSAND" or kind == "TIMES":
+                    self.index = index + 1
+                    stack.append([kind, power, None])
+                    power = PREFIX
+                elif kind == "HASH":
+                    self.index = index + 1
+                    id = self.expect("ID")
+                    self.expect("LPAREN")
+                    stack.append(["compcall", power, (id, [])])
+                    power = 0
+                elif kind == "ID" and types[index + 1] == "LPAREN" and types[index + 2] != "RPAREN":
+                    self.index = index + 2
+                    stack.append(["call", power, (values[index], [])])
+                    power = 0
+                elif kind == "ID" and types[index + 1] in ("LBRACE", "COLON"):
+                    stack.append(["struct", power, self.struct_init(values[index])])
+                    power = 0
+                else:
+                    break
+            left = self.atom()
+
+            # Operators, then closing the frames whose operand is complete
+            while True:
+                kind = types[self.index]
+                if kind == "FIELD_DEREFERENCE":
+                    # Binds tighter than everything, whatever the power
+                    self.index += 1
+                    left = nodes.FieldDereference(left, self.expect("ID"))
+                    continue
+                binding = BINARY.get(kind)
+                if binding is not None and binding > power:
+                    operator = values[self.index]
+                    self.index += 1
+                    stack.append(["binary", power, (left, operator)])
+                    power = binding
+                    break
+                if not stack:
+                    return left
+                frame = stack.pop()
+                kind, power, data = frame
+                if kind == "binary":
+                    left = nodes.Expression(data[0], left, data[1])
+                elif kind == "group":
+                    self.expect("RPAREN")
+                    left = nodes.Group(left)
+                elif kind == "AMPERSAND":
+                    left = nodes.Reference(left)
+                elif kind == "TIMES":
+                    left = nodes.Dereference(left)
+                elif kind == "struct":
+                    id, arena, members, member = data
+                    members.append(nodes.StructInitMember(id=member, expression=left))
+                    if self.accept("COMMA"):
+                        data[3] = self.expect("ID")
+                        self.expect("COLON")
+                        stack.append(frame)
+                        power = 0
+                        break
+                    self.expect("RBRACE")
+                    if arena:
+                        left = nodes.StructInit(id=id, members=members, alloc=True, arena=arena)
+                    else:
+                        left = nodes.StructInit(id=id, members=members, alloc=False)
+                else:
+                    id, arguments = data
+                    arguments.append(left)
+                    if self.accept("COMMA"):
+                        stack.append(frame)
+                        power = 0
+                        break
+                    self.expect("RPAREN")
+                    if kind == "call":
+                        left = nodes.Call(id=id, args=nodes.ArgumentList(arguments))
+                    else:
+                        left = nodes.CompCall(id=id, arguments=nodes.ArgumentList(arguments))
+
+    def struct_init(self, id: str) -> list:
+        # Reads `S {member:` or `S:arena {member:`, returns the frame data
+        # [id, arena, members, member]
+        self.index += 1
+        arena = None
+        if self.accept("COLON"):
+            arena = self.expect("ID")
+        self.expect("LBRACE")
+        member = self.expect("ID")
+        self.expect("COLON")
+        return [id, arena, [], member]
+
+    def atom(self):
+        # An operand opening no construct
+        index = self.index
+        kind = self.types[index]
+        if kind == END:
+            raise ParseError(index)
+        value = self.values[index]
+        self.index = index + 1
+
+        if kind == "ID":
+            if self.types[index + 1] == "LPAREN":
+                # Calls with arguments are frames of expression
+                self.index += 2
+                return nodes.Call(id=value)
+            return nodes.Identifier(value)
+        if kind == "ICONST":
+            return nodes.Integer(value, 32)
+        if kind == "STRCONST":
+            return nodes.String(value)
+        if kind == "REF":
+            return nodes.Reference(nodes.Identifier(self.expect("ID")))
+        raise ParseError(index)
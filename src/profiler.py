@@ -0,0 +1,141 @@
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def count_nodes(root) -> int:
+    # Counts AST nodes reachable from root (types and scopes are not nodes)
+    count = 0
+    seen = set()
+    stack = [root]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, (list, tuple)):
+            stack.extend(value)
+            continue
+        if not type(value).__module__.startswith("src.nodes."):
+            continue
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        count += 1
+        if hasattr(value, "__dict__"):
+            stack.extend(vars(value).values())
+        for cls in type(value).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                if hasattr(value, slot):
+                    stack.append(getattr(value, slot))
+    return count
+
+
+def max_rss_kb() -> int | None:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PhaseRecord():
+    def __init__(self, name: str, start: float):
+        self.name = name
+        self.start = start
+        self.wall = 0.0
+        self.peak_alloc = None
+        self.max_rss = None
+        self.nodes = None
+        self.tree = None
+
+    def to_dict(self):
+        return {"name": self.name, "wall": self.wall, "peak_alloc": self.peak_alloc,
+                "max_rss_kb": self.max_rss, "nodes": self.nodes}
+
+
+class PhaseProfiler():
+    # Measures wall time, traced allocation peak, max RSS and AST size of
+    # every compiler phase. Disabled profilers cost one branch per phase.
+    def __init__(self, enabled=False, memory=True, cprofile_path=None, trace_path=None):
+        self.enabled = enabled or bool(cprofile_path) or bool(trace_path)
+        self.memory = memory
+        self.cprofile_path = cprofile_path
+        self.trace_path = trace_path
+        self.records: list[PhaseRecord] = []
+        self._profile = None
+        self._origin = time.perf_counter()
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile_path:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    @contextmanager
+    def phase(self, name: str, tree=None):
+        record = PhaseRecord(name, time.perf_counter())
+        record.tree = tree
+        if not self.enabled:
+            yield record
+            return
+
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        try:
+            yield record
+        finally:
+            record.wall = time.perf_counter() - record.start
+            if self.memory and tracemalloc.is_tracing():
+                record.peak_alloc = tracemalloc.get_traced_memory()[1]
+            record.max_rss = max_rss_kb()
+            if record.tree is not None:
+                record.nodes = count_nodes(record.tree)
+                record.tree = None
+            self.records.append(record)
+
+    def stop(self):
+        if not self.enabled:
+            return
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.cprofile_path)
+            self._profile = None
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        if self.trace_path:
+            self.write_trace(self.trace_path)
+
+    def report(self) -> str:
+        lines = [f'{"phase":<20}{"wall ms":>10}{"peak KiB":>12}{"max RSS KiB":>14}{"nodes":>8}']
+        for record in self.records:
+            peak = "-" if record.peak_alloc is None else f"{record.peak_alloc / 1024:.1f}"
+            rss = "-" if record.max_rss is None else str(record.max_rss)
+            nodes = "-" if record.nodes is None else str(record.nodes)
+            lines.append(
+                f'{record.name:<20}{record.wall * 1000:>10.2f}{peak:>12}{rss:>14}{nodes:>8}')
+        # "module:phase" records ran inside another phase (worker processes)
+        total = sum(record.wall for record in self.records
+                    if ":" not in record.name)
+        lines.append(f'{"total":<20}{total * 1000:>10.2f}')
+        return "\n".join(lines)
+
+    def write_trace(self, path: str):
+        # Chrome trace event format, loadable in chrome://tracing / Perfetto
+        events = [{
+            "name": record.name,
+            "ph": "X",
+            "ts": (record.start - self._origin) * 1e6,
+            "dur": record.wall * 1e6,
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": record.to_dict(),
+        } for record in self.records]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events}, f, indent=1)
@@ -0,0 +1,285 @@
+import hashlib
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src import abi, cgen
+from src.cache import BuildCache, cache_dir, fingerprint
+from src.error import CompileError, CompileErrors, print_success, throw_compiler_error
+from src import log
+from src.log import DRIVER
+from src.main import PitchCompiler
+from src.nodes.block import Function, Struct
+from src.nodes.program import Program
+from src.nodes.utils import printlog
+from src.profiler import PhaseProfiler
+from src.pitchtypes import FunctionType, LocalStringType, StructType
+from src.source import Source
+
+
+class ModuleInterface():
+    # What a module exports to its importers: struct layouts and function
+    # signatures, plus the modules its own header depends on.
+    def __init__(self, name: str, structs: list[StructType], functions: dict[str, FunctionType], imports: list[str]):
+        self.name = name
+        self.structs = structs
+        self.functions = functions
+        self.imports = imports
+
+    def __repr__(self):
+        return f'ModuleInterface({self.name}, {self.structs}, {self.functions})'
+
+    @property
+    def header_name(self):
+        return f"{self.name}.h"
+
+    @classmethod
+    def from_program(cls, name: str, program: Program, modules: list[str]):
+        structs = []
+        functions = {}
+        for statement in program.statements:
+            if isinstance(statement, Struct):
+                structs.append(program.scope.find(statement.id).type)
+            elif isinstance(statement, Function):
+                functions[statement.id] = FunctionType(
+                    statement.return_type,
+                    [param.type for param in statement.params.parameters])
+        imports = [module for module in program.imports() if module in modules]
+        return cls(name, structs, functions, imports)
+
+    def export(self, scope):
+        for struct in self.structs:
+            scope.add(struct.name, struct)
+        for name, function_type in self.functions.items():
+            scope.add(name, function_type)
+
+    def header(self) -> str:
+        guard = f"PITCH_{self.name.upper()}_H"
+        lines = [f"#ifndef {guard}", f"#define {guard}", "",
+                 "#include <stdint.h>", "#include <stdbool.h>"]
+        lines.extend(f'#include "{module}.h"' for module in self.imports)
+        lines.append("")
+
+        types = [t for struct in self.structs for t in struct.fields.values()]
+        for function_type in self.functions.values():
+            types.extend([function_type.return_type, *function_type.params])
+        if any(isinstance(t, LocalStringType) for t in types):
+            lines.append(cgen.STRING_TYPEDEF)
+            lines.append("")
+
+        for struct in self.structs:
+            members = "\n    ".join(
+                [f'{t.to_c()} {member};' for member, t in struct.fields.items()])
+            lines.append(f'struct {struct.name} {{\n    {members}\n}};')
+            lines.append("")
+
+        for name, function_type in self.functions.items():
+            lines.append(abi.prototype(name, function_type))
+
+        lines.extend(["", f"#endif /* {guard} */", ""])
+        return "\n".join(lines)
+
+
+# One compiler per worker process, so the parser tables are bound once.
+_compiler: PitchCompiler = None
+
+
+def _init_worker(debug, log_phases, profile, parser):
+    global _compiler
+    log.configure(debug, log_phases)
+    _compiler = PitchCompiler(debug=debug, log_phases=log_phases,
+                              profiler=PhaseProfiler(enabled=profile), parser=parser)
+    _compiler.profiler.start()
+
+
+def _take_records(name: str):
+    records = _compiler.profiler.records
+    _compiler.profiler.records = []
+    for record in records:
+        record.name = f"{name}:{record.name}"
+    return records
+
+
+def _parse_module(path: str) -> Program:
+    printlog("Parsing", path)
+    try:
+        with Source(path) as source:
+            return _compiler.parse(source.buffer), _take_records(module_name(path))
+    except CompileError as error:
+        raise error.located(path)
+
+
+def _build_module(name: str, program: Program | str, modules: dict[str, ModuleInterface], names: list[str], cache: BuildCache, key: str, path: str):
+    if isinstance(program, str):
+        program, _ = _parse_module(program)
+    printlog("Checking", name, "against", list(modules))
+    try:
+        _compiler.analyze(program, modules)
+    except CompileError as error:
+        raise error.located(path)
+    interface = ModuleInterface.from_program(name, program, names)
+    buffer = io.StringIO()
+    _compiler.generate(program, buffer, header=interface.header_name)
+    c = buffer.getvalue()
+    header = interface.header()
+    cache.store("module", key, (interface, c, header, program))
+    return interface, c, header, _take_records(name)
+
+
+def results(futures: dict) -> dict:
+    # Waits for every module, so the errors of all of them are reported
+    # together
+    done = {}
+    diagnostics = []
+    for name, future in futures.items():
+        try:
+            done[name] = future.result()
+        except CompileError as error:
+            diagnostics.extend(error.diagnostics)
+    if diagnostics:
+        raise CompileErrors(diagnostics)
+    return done
+
+
+def collect_sources(sources: list[str]) -> list[str]:
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths.extend(os.path.join(root, file)
+                             for file in files if file.endswith(".pitch"))
+        else:
+            paths.append(source)
+    return sorted(paths)
+
+
+def module_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+class ProjectCompiler():
+    def __init__(self, sources: list[str], out_path=None, debug=False, log_phases=None, jobs=None, cache=True, profiler: PhaseProfiler = None, parser="lalr"):
+        self.sources = sources
+        self.parser = parser
+        self.profiler = profiler or PhaseProfiler()
+        self.out_dir = out_path
+        self.debug = debug
+        self.log_phases = log_phases
+        self.jobs = jobs
+        self.cache = BuildCache(cache_dir("build") if cache else None)
+        log.configure(debug, log_phases)
+
+    def waves(self, imports: dict[str, list[str]]) -> list[list[str]]:
+        # Group modules into dependency levels; every module only depends
+        # on modules of earlier waves, so a wave can be built in parallel.
+        remaining = dict(imports)
+        done = set()
+        waves = []
+        while remaining:
+            wave = sorted(name for name, deps in remaining.items()
+                          if all(dep in done for dep in deps))
+            if not wave:
+                throw_compiler_error(
+                    f'Import cycle between modules {", ".join(sorted(remaining))}')
+            for name in wave:
+                del remaining[name]
+            done.update(wave)
+            waves.append(wave)
+        return waves
+
+    def compile(self):
+        paths = collect_sources(self.sources)
+        if not paths:
+            throw_compiler_error("No source files specified")
+
+        names = [module_name(path) for path in paths]
+        if len(set(names)) != len(names):
+            duplicates = sorted({name for name in names if names.count(name) > 1})
+            throw_compiler_error(
+                f'Duplicate module names {", ".join(duplicates)}')
+
+        if not os.path.isdir(self.out_dir):
+            os.makedirs(self.out_dir)
+
+        self.profiler.start()
+        paths = dict(zip(names, paths))
+        source_keys = {}
+        with self.profiler.phase("hash"):
+            for name, path in paths.items():
+                with open(path, "rb") as f:
+                    source_keys[name] = self.cache.key(
+                        hashlib.sha256(f.read()).hexdigest())
+
+        # Import lists of unchanged sources come from the cache, only new or
+        # edited modules are parsed up front.
+        imports = {name: self.cache.load("imports", key)
+                   for name, key in source_keys.items()}
+        stale = [name for name, module_imports in imports.items()
+                 if module_imports is None]
+
+        with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                 initargs=(self.debug, self.log_phases, self.profiler.enabled,
+                                           self.parser)) as pool:
+            programs = {}
+            with self.profiler.phase("parse"):
+                parsed = {name: pool.submit(_parse_module, paths[name]) for name in stale}
+                for name, (program, records) in results(parsed).items():
+                    programs[name] = program
+                    self.profiler.records.extend(records)
+            for name, program in programs.items():
+                imports[name] = program.imports()
+                self.cache.store("imports", source_keys[name], imports[name])
+            print_success(f"Parsed {len(programs)} of {len(paths)} modules")
+
+            imports = {name: [module for module in module_imports if module in paths]
+                       for name, module_imports in imports.items()}
+
+            interfaces: dict[str, ModuleInterface] = {}
+            interface_keys: dict[str, str] = {}
+            for index, wave in enumerate(self.waves(imports)):
+                printlog("Building wave", wave, phase=DRIVER)
+                with self.profiler.phase(f"wave {index}"):
+                    self.build_wave(pool, wave, paths, names, programs, imports,
+                                    source_keys, interfaces, interface_keys)
+
+        self.profiler.stop()
+        if self.profiler.enabled:
+            print(self.profiler.report())
+
+    def build_wave(self, pool, wave, paths, names, programs, imports, source_keys, interfaces, interface_keys):
+        futures = {}
+        for name in wave:
+            # A module is rebuilt when its source or the interface
+            # (not the body) of a module it imports changed.
+            key = self.cache.key(source_keys[name], [
+                (dep, interface_keys[dep]) for dep in sorted(imports[name])])
+            cached = self.cache.load("module", key)
+            if cached:
+                interface, c, header, _ = cached
+                self.finish(name, interface, c, header, interfaces, interface_keys)
+                print_success(f"Up to date {name}")
+                continue
+
+            futures[name] = pool.submit(_build_module, name, programs.get(name, paths[name]),
+                                        {dep: interfaces[dep] for dep in imports[name]}, names,
+                                        self.cache, key, paths[name])
+
+        for name, (interface, c, header, records) in results(futures).items():
+            self.profiler.records.extend(records)
+            self.finish(name, interface, c, header, interfaces, interface_keys)
+            print_success(f"Compiled {name}")
+
+    def finish(self, name, interface, c, header, interfaces, interface_keys):
+        interfaces[name] = interface
+        interface_keys[name] = fingerprint(header)
+        self.write(f"{name}.c", c)
+        self.write(f"{name}.h", header)
+
+    def write(self, file_name: str, content: str):
+        path = os.path.join(self.out_dir, file_name)
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                if f.read() == content:
+                    return
+        with open(path, "w") as f:
+            f.write(content)
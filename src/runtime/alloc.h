@@ -0,0 +1,58 @@
+#ifndef PITCH_RUNTIME_ALLOC_H
+#define PITCH_RUNTIME_ALLOC_H
+
+#include <stddef.h>
+#include <stdlib.h>
+
+/* Size classed heap: requests are rounded up to a power of two between
+   16 and 2048 bytes and served from a free list per class, refilled from
+   64KiB slabs. Larger requests go to malloc. Pitch programs never free,
+   so blocks carry no header recording their class.
+   Sizes are usually compile time constants, so the class lookup folds
+   away and a small allocation is a single list pop. */
+
+#define _PT_ALLOC_MIN_SHIFT 4
+#define _PT_ALLOC_CLASSES 8
+#define _PT_ALLOC_LARGE _PT_ALLOC_CLASSES
+#define _PT_ALLOC_SLAB_SIZE ((size_t)64 * 1024)
+
+typedef struct _pt_alloc_item {
+    struct _pt_alloc_item *next;
+} _pt_alloc_item;
+
+static _pt_alloc_item *_pt_alloc_pools[_PT_ALLOC_CLASSES];
+
+static inline size_t _pt_alloc_class(size_t size) {
+    size_t size_class = 0;
+    while (size_class < _PT_ALLOC_CLASSES &&
+           ((size_t)1 << (size_class + _PT_ALLOC_MIN_SHIFT)) < size)
+        size_class++;
+    return size_class;
+}
+
+static void _pt_alloc_refill(size_t size_class) {
+    size_t block = (size_t)1 << (size_class + _PT_ALLOC_MIN_SHIFT);
+    size_t count = _PT_ALLOC_SLAB_SIZE / block;
+    unsigned char *slab = malloc(block * count);
+    if (!slab) abort();
+    for (size_t i = count; i > 0; i--) {
+        _pt_alloc_item *item = (_pt_alloc_item *)(slab + (i - 1) * block);
+        item->next = _pt_alloc_pools[size_class];
+        _pt_alloc_pools[size_class] = item;
+    }
+}
+
+static inline void *_pt_alloc(size_t size) {
+    size_t size_class = _pt_alloc_class(size);
+    if (size_class == _PT_ALLOC_LARGE) {
+        void *ptr = malloc(size);
+        if (!ptr) abort();
+        return ptr;
+    }
+    if (!_pt_alloc_pools[size_class]) _pt_alloc_refill(size_class);
+    _pt_alloc_item *item = _pt_alloc_pools[size_class];
+    _pt_alloc_pools[size_class] = item->next;
+    return item;
+}
+
+#endif /* PITCH_RUNTIME_ALLOC_H */
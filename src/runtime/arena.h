@@ -0,0 +1,59 @@
+#ifndef PITCH_RUNTIME_ARENA_H
+#define PITCH_RUNTIME_ARENA_H
+
+#include <stddef.h>
+#include <stdlib.h>
+
+/* Bump pointer arenas: allocation advances a pointer inside the current
+   block, a full block is chained and a new one started. Everything is
+   released at once by _pt_arena_free. */
+
+#define _PT_ARENA_ALIGN _Alignof(max_align_t)
+#define _PT_ARENA_BLOCK_SIZE ((size_t)64 * 1024)
+
+typedef struct _pt_arena_block {
+    struct _pt_arena_block *next;
+    size_t used;
+    size_t size;
+    _Alignas(max_align_t) unsigned char data[];
+} _pt_arena_block;
+
+typedef struct {
+    _pt_arena_block *head;
+} _pt_arena;
+
+static inline _pt_arena *_pt_arena_new(void) {
+    _pt_arena *arena = malloc(sizeof(_pt_arena));
+    if (!arena) abort();
+    arena->head = NULL;
+    return arena;
+}
+
+static inline void *_pt_arena_alloc(_pt_arena *arena, size_t size) {
+    size = (size + _PT_ARENA_ALIGN - 1) & ~(_PT_ARENA_ALIGN - 1);
+    _pt_arena_block *block = arena->head;
+    if (!block || block->size - block->used < size) {
+        size_t capacity = size > _PT_ARENA_BLOCK_SIZE ? size : _PT_ARENA_BLOCK_SIZE;
+        block = malloc(sizeof(_pt_arena_block) + capacity);
+        if (!block) abort();
+        block->next = arena->head;
+        block->used = 0;
+        block->size = capacity;
+        arena->head = block;
+    }
+    void *ptr = block->data + block->used;
+    block->used += size;
+    return ptr;
+}
+
+static inline void _pt_arena_free(_pt_arena *arena) {
+    _pt_arena_block *block = arena->head;
+    while (block) {
+        _pt_arena_block *next = block->next;
+        free(block);
+        block = next;
+    }
+    free(arena);
+}
+
+#endif /* PITCH_RUNTIME_ARENA_H */
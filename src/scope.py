@@ -1,48 +1,86 @@
-import logging
-from src.pitchtypes import TypeBase
+from src.error import Diagnostics
+from src.log import SCOPE, printlog
+from src.pitchtypes import TypeBase, TypeResolver
 
 
 class ScopeEntry():
-    def __init__(self, name: str, type: str):
+    def __init__(self, name: str, type: str, lib=None):
         self.name = name
         self.type = type
+        # Library function backing this name, if any
+        self.lib = lib
+        # For arenas and references allocated in one: the entry of the
+        # let whose Arena() call created the arena. None when the arena
+        # belongs to a caller, such as an Arena parameter.
+        self.arena: ScopeEntry | None = None
 
     def __repr__(self):
         return f'({self.name}: {self.type})'
 
 
 class Scope():
-    def __init__(self, identifier, parent=None, inject=None):
+    # First entry added under a name wins, inner scopes shadow outer ones.
+    # Lookups falling through to parents are cached (flattened); a name
+    # added to a scope is dropped from the caches below it only.
+    def __init__(self, identifier, parent=None, inject=None, flatten=True, diagnostics: Diagnostics = None):
         self.identifier = identifier
         self.parent = parent
-        self.entries: list[ScopeEntry] = []
+        self.entries: dict[str, ScopeEntry] = {}
+        self.flatten = flatten
+        self._cache: dict[str, ScopeEntry | None] = {}
+        # Child scopes whose lookups of a name went on to this scope
+        self._lookups: dict[str, set[Scope]] = {}
+        # Named type resolution, memoized for the whole tree
+        self.types: TypeResolver = parent.types if parent else TypeResolver(self)
+        # Errors of the whole tree, checking goes on past each one
+        self.diagnostics: Diagnostics = parent.diagnostics if parent else \
+            diagnostics if diagnostics is not None else Diagnostics()
         if inject:
             for entry in inject:
-                self.add(entry.name, entry.type)
+                if entry.name not in self.entries:
+                    self.entries[entry.name] = entry
 
-    def add(self, name: str, type: TypeBase):
-        logging.info(f"Adding {name} to scope {self.identifier}")
-        self.entries.append(ScopeEntry(name, type))
+    def add(self, name: str, type: TypeBase, lib=None) -> ScopeEntry:
+        # Returns the entry the name resolves to in this scope
+        printlog("Adding", name, "to scope", self.identifier, phase=SCOPE)
+        if name not in self.entries:
+            self.entries[name] = ScopeEntry(name, type, lib)
+            if name in self._lookups:
+                self._forget(name)
+        return self.entries[name]
 
-    def find(self, name: str):
-        for entry in self.entries:
-            if entry.name == name:
-                return entry
+    def _forget(self, name: str):
+        # Drops name from the caches of the scopes whose lookups of it
+        # went through this one, each cached lookup is forgotten once
+        stack = [self]
+        while stack:
+            scope = stack.pop()
+            for child in scope._lookups.pop(name, ()):
+                child._cache.pop(name, None)
+                stack.append(child)
 
-        if self.parent:
-            return self.parent.find(name)
+    def find(self, name: str):
+        entry = self.entries.get(name)
+        if entry or not self.parent:
+            return entry
 
-        return None
+        if self.flatten:
+            if name in self._cache:
+                return self._cache[name]
+            entry = self._cache[name] = self.parent.find(name)
+        else:
+            entry = self.parent.find(name)
+        lookups = self.parent._lookups.get(name)
+        if lookups is None:
+            lookups = self.parent._lookups[name] = set()
+        lookups.add(self)
+        return entry
 
     def __setitem__(self, name: str, type: str):
         self.add(name, type)
 
     def __getitem__(self, name: str):
-        for entry in self.entries:
-            if entry.name == name:
-                return entry
-
-        return None
+        return self.entries.get(name)
 
     def __repr__(self):
-        return f'Scope({self.entries})'
+        return f'Scope({list(self.entries.values())})'
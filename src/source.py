@@ -0,0 +1,38 @@
+import mmap
+import os
+
+
+class Source():
+    # A source file mapped read only into memory. The lexer matches the
+    # mapped bytes directly, so the file is never read or decoded as a
+    # whole; token offsets index the mapping and text is decoded per
+    # token, or per slice for diagnostics.
+    __slots__ = ("path", "buffer")
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                # Empty files can not be mapped
+                self.buffer = b""
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def text(self, start: int = 0, end: int = None) -> str:
+        return self.buffer[start:end].decode(errors="replace")
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return f'Source({self.path!r}, {len(self)} bytes)'
@@ -0,0 +1,246 @@
+import re
+import string
+import sys
+from array import array
+from bisect import bisect_right
+
+from src.error import Diagnostics, Span, print_error
+from src.log import LEX
+from src.nodes.utils import printlog
+from src.pitchlexer import PitchLexer
+
+# Hand written lexer. One compiled pattern splits the source into tokens,
+# runs of blanks and runs of newlines, every character lands in exactly
+# one piece so offsets are a running sum of lengths. The first character
+# of a piece decides its class. Floats are tried before integers and
+# strings stop at the first closing quote.
+#
+# No piece spans a newline, so the source is matched in chunks cut after
+# a newline: the list findall builds holds one chunk's pieces, not the
+# whole file's.
+CHUNK = 1 << 16
+
+PUNCTUATION = {
+    "->": "FIELD_DEREFERENCE",
+    "==": "DOUBLE_EQUALS",
+    "+": "PLUS",
+    "-": "MINUS",
+    # Multiplication and dereference, the grammar tells them apart
+    "*": "TIMES",
+    "/": "DIVIDE",
+    ";": "SEMI",
+    "(": "LPAREN",
+    ")": "RPAREN",
+    "{": "LBRACE",
+    "}": "RBRACE",
+    "=": "EQUALS",
+    "#": "HASH",
+    ",": "COMMA",
+    ":": "COLON",
+    "?": "QUESTIONMARK",
+    "!": "EXCLAMATIONMARK",
+    "&": "AMPERSAND",
+}
+
+TOKEN_PATTERN = "|".join([
+    r"[ \t\r]+",
+    r"\n+",
+    r"[0-9]+(?:\.[0-9]+)?",
+    r'"[^"\n]*"',
+    r"[a-zA-Z_][a-zA-Z_0-9]*",
+    r"->|==",
+    # Punctuation, or an illegal character
+    r"[\s\S]",
+])
+
+# First character -> class of the piece
+START: dict[str, str] = {char: "ID" for char in string.ascii_letters + "_"}
+START.update({char: "NUMBER" for char in string.digits})
+START.update({char: "SKIP" for char in " \t\r"})
+START.update({text[0]: "PUNCT" for text in PUNCTUATION})
+START["\n"] = "NEWLINE"
+START['"'] = "STRCONST"
+
+
+class Lexicon():
+    # The tables for lexing one kind of buffer. Text sources are lexed as
+    # they are; bytes (a mapped file) are matched as bytes and only the
+    # text of names and strings is decoded.
+    __slots__ = ("pattern", "start", "words", "punctuation", "decode", "newline")
+
+    def __init__(self, encode, decode):
+        self.pattern = re.compile(encode(TOKEN_PATTERN))
+        self.start = {encode(char)[0]: kind for char, kind in START.items()}
+        # Keyword / punctuation text -> (type, value)
+        self.words = {encode(word): (kind, word) for word, kind in PitchLexer.reserved.items()}
+        self.punctuation = {encode(text): (kind, text) for text, kind in PUNCTUATION.items()}
+        self.decode = decode
+        self.newline = encode("\n")
+
+
+TEXT = Lexicon(str, str)
+BYTES = Lexicon(str.encode, bytes.decode)
+
+
+class Tokens():
+    # Token array of one source: parallel arrays instead of an object per
+    # token. Offsets index the source; columns are derived on demand
+    # from the start offset of each line.
+    __slots__ = ("source", "types", "values", "offsets", "ends", "lines", "line_starts")
+
+    def __init__(self, source):
+        self.source = source
+        self.types: list[str] = []
+        self.values: list = []
+        self.offsets = array("l")
+        self.ends = array("l")
+        self.lines = array("l")
+        self.line_starts = array("l", [0])
+
+    @classmethod
+    def lines_of(cls, source: str):
+        # No tokens, only the line starts of a source PLY lexes
+        tokens = cls(source)
+        tokens.line_starts.extend([match.end() for match in re.finditer("\n", source)])
+        return tokens
+
+    def __len__(self):
+        return len(self.types)
+
+    def position(self, offset: int) -> tuple[int, int]:
+        # 1 based line and column of a source offset
+        line = bisect_right(self.line_starts, offset)
+        return line, offset - self.line_starts[line - 1] + 1
+
+    def span(self, start: int, end: int) -> Span:
+        return Span(start, end, *self.position(start))
+
+    def token_span(self, first: int, last: int) -> Span:
+        # From the start of token first to the end of token last
+        return self.span(self.offsets[first], self.ends[last])
+
+    def text(self, start: int, end: int) -> str:
+        # Source text between two offsets, decoded only here
+        text = self.source[start:end]
+        if isinstance(text, str):
+            return text
+        return bytes(text).decode(errors="replace")
+
+    def __repr__(self):
+        return f'Tokens({len(self)} tokens, {len(self.line_starts)} lines)'
+
+
+def tokenize(source, diagnostics: Diagnostics = None) -> Tokens:
+    # source is a str or a buffer of UTF-8 bytes, such as a mapped file;
+    # offsets index into it. Illegal characters go to diagnostics if
+    # given, else they are printed.
+    lexicon = TEXT if isinstance(source, str) else BYTES
+    tokens = Tokens(source)
+    append_type = tokens.types.append
+    append_value = tokens.values.append
+    append_offset = tokens.offsets.append
+    append_end = tokens.ends.append
+    append_line = tokens.lines.append
+    line_starts = tokens.line_starts
+    classify = lexicon.start.get
+    words = lexicon.words.get
+    punctuation = lexicon.punctuation
+    decode = lexicon.decode
+    intern = sys.intern
+    line = 1
+    end = 0
+    # Start of the run of illegal characters being collected
+    illegal = None
+
+    findall = lexicon.pattern.findall
+    newline = lexicon.newline
+    size = len(source)
+    while end < size:
+        cut = source.find(newline, end + CHUNK) + 1 or size
+        for text in findall(source, end, cut):
+            start = end
+            end += len(text)
+            kind = classify(text[0])
+            if kind == "STRCONST" and len(text) == 1:
+                # Unterminated string
+                kind = None
+            if kind is None:
+                if illegal is None:
+                    illegal = start
+                continue
+            if illegal is not None:
+                report_illegal(tokens, illegal, start, diagnostics)
+                illegal = None
+
+            if kind == "ID":
+                word = words(text)
+                if word is None:
+                    kind = "ID"
+                    # Names repeat all over a program, every node shares one string
+                    text = intern(decode(text))
+                else:
+                    kind, text = word
+            elif kind == "SKIP":
+                continue
+            elif kind == "PUNCT":
+                kind, text = punctuation[text]
+            elif kind == "NEWLINE":
+                line += len(text)
+                line_starts.extend(range(start + 1, end + 1))
+                continue
+            elif kind == "NUMBER":
+                if text.isdigit():
+                    kind, text = "ICONST", int(text)
+                else:
+                    kind, text = "FCONST", float(text)
+            elif kind == "STRCONST":
+                text = decode(text)
+            append_type(kind)
+            append_value(text)
+            append_offset(start)
+            append_end(end)
+            append_line(line)
+
+    if illegal is not None:
+        report_illegal(tokens, illegal, end, diagnostics)
+    printlog("Lexed", len(tokens), "tokens", phase=LEX)
+    return tokens
+
+
+def report_illegal(tokens: Tokens, start: int, end: int, diagnostics: Diagnostics | None):
+    # One error per run of illegal characters
+    message = f"Illegal character {tokens.text(start, end)!r}"
+    span = tokens.span(start, end)
+    if diagnostics is None:
+        print_error(f"{message} at line {span.line}, column {span.column}")
+    else:
+        diagnostics.error(message, span)
+
+
+class Token():
+    # What PLY's parser reads off a token
+    __slots__ = ("type", "value", "lineno", "lexpos", "lexer")
+
+    def __init__(self, type, value, lineno, lexpos):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+
+    def __repr__(self):
+        return f'Token({self.type},{self.value!r},{self.lineno},{self.lexpos})'
+
+
+class TokenStream():
+    # Feeds a Tokens array to PLY's parser through the lexer interface
+    def __init__(self, tokens: Tokens):
+        self.tokens = tokens
+        self.next = zip(tokens.types, tokens.values, tokens.lines, tokens.offsets)
+
+    def input(self, source: str):
+        self.__init__(tokenize(source))
+
+    def token(self) -> Token | None:
+        for type, value, lineno, lexpos in self.next:
+            return Token(type, value, lineno, lexpos)
+        return None